@@ -1,12 +1,39 @@
-from flask import Flask, request, render_template_string
+from flask import (Flask, Response, g, has_request_context, jsonify, request,
+                   stream_with_context)
+from markupsafe import Markup
 import gspread
+import requests
+from gspread.utils import absolute_range_name, numericise_all
 from oauth2client.service_account import ServiceAccountCredentials
 import re
 import os
+import sys
 from pathlib import Path
+from array import array
+import base64
+import bisect
+import csv
+import datetime
+import hashlib
+import heapq
 import json
+import math
+import random
+import sqlite3
+import tempfile
+from collections import OrderedDict, deque
+from collections.abc import Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
+import time
 import traceback
 
+try:
+  import fcntl
+except ImportError:  # Windows
+  fcntl = None
+
 app = Flask(__name__)
 
 # ====== 設定 ======
@@ -58,6 +85,392 @@ def gclient():
     raise
 
 
+# ====== 計時與統計（Server-Timing 標頭與 /__metrics） ======
+# 每個階段保留最近幾筆耗時來算百分位數
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+
+
+class Metrics:
+  """
+    各階段耗時（保留最近 window 筆，算 p50 / p95 / p99）與事件次數
+    （例如 Google API 呼叫）；多執行緒共用，以 lock 保護。
+    """
+
+  def __init__(self, window):
+    self._window = window
+    self._lock = threading.Lock()
+    self._samples = {}
+    self._observed = {}
+    self._counts = {}
+
+  def observe(self, stage, ms):
+    with self._lock:
+      samples = self._samples.get(stage)
+      if samples is None:
+        samples = self._samples[stage] = deque(maxlen=self._window)
+      samples.append(ms)
+      self._observed[stage] = self._observed.get(stage, 0) + 1
+
+  def incr(self, name, n=1):
+    with self._lock:
+      self._counts[name] = self._counts.get(name, 0) + n
+
+  @staticmethod
+  def _percentile(ordered, q):
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+  def stats(self) -> dict:
+    with self._lock:
+      samples = {k: sorted(v) for k, v in self._samples.items()}
+      observed = dict(self._observed)
+      counts = dict(self._counts)
+    timings = {}
+    for stage, ordered in sorted(samples.items()):
+      timings[stage] = {
+          "count": observed[stage],
+          "p50_ms": round(self._percentile(ordered, 0.50), 2),
+          "p95_ms": round(self._percentile(ordered, 0.95), 2),
+          "p99_ms": round(self._percentile(ordered, 0.99), 2),
+          "max_ms": round(ordered[-1], 2),
+      }
+    return {"window": self._window, "timings": timings, "counts": counts}
+
+
+metrics = Metrics(METRICS_WINDOW)
+
+
+@contextmanager
+def timed(stage):
+  """量一個階段的耗時：記進 metrics，請求中另外放進 Server-Timing 標頭。"""
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    ms = (time.perf_counter() - started) * 1000
+    metrics.observe(stage, ms)
+    if has_request_context():
+      g.setdefault('timings', []).append((stage, ms))
+
+
+@app.before_request
+def start_timer():
+  g.started = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+  timings = g.pop('timings', [])
+  started = g.pop('started', None)
+  if started is not None:
+    total = (time.perf_counter() - started) * 1000
+    timings.append(('total', total))
+    metrics.observe(f"request.{request.endpoint or 'unknown'}", total)
+  if timings:
+    response.headers['Server-Timing'] = ', '.join(
+        f"{stage};dur={ms:.1f}" for stage, ms in timings)
+  return response
+
+
+# ====== 共用 gspread client ======
+# OAuth access token 約 1 小時到期；剩不到這麼多秒時就先換新 token
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+
+
+class ClientPool:
+  """
+    整個 process 共用一個已授權的 gspread client 與 Spreadsheet handle：
+    - 只在第一次使用時解析憑證並 authorize
+    - token 快到期前主動 refresh（不必重建 client）
+    - 以 lock 保護，gunicorn 多執行緒可安全共用
+    """
+
+  def __init__(self, spreadsheet_id, margin):
+    self._spreadsheet_id = spreadsheet_id
+    self._margin = datetime.timedelta(seconds=margin)
+    self._lock = threading.Lock()
+    self._client = None
+    self._spreadsheet = None
+
+  def client(self):
+    with self._lock:
+      if self._client is None:
+        with timed('auth'):
+          self._client = gclient()
+        metrics.incr('google.authorize')
+        self._spreadsheet = None
+      self._refresh_if_needed()
+      return self._client
+
+  def open(self):
+    """回傳（快取的）Spreadsheet handle。"""
+    client = self.client()
+    with self._lock:
+      if self._spreadsheet is None:
+        with timed('open_by_key'):
+          self._spreadsheet = client.open_by_key(self._spreadsheet_id)
+        metrics.incr('google.open_by_key')
+      return self._spreadsheet
+
+  def reset(self):
+    """授權失效時丟掉 client，下次取用會重新 authorize。"""
+    with self._lock:
+      self._client = None
+      self._spreadsheet = None
+
+  def _refresh_if_needed(self):
+    # gspread 6 把 auth 放在 client.http_client；5.x 直接在 client 上
+    http = getattr(self._client, 'http_client', self._client)
+    auth = getattr(http, 'auth', None)
+    if auth is None:
+      return
+    expiry = getattr(auth, 'expiry', None)
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if expiry is None or expiry - now < self._margin:
+      http.login()
+      metrics.incr('google.token_refresh')
+
+
+client_pool = ClientPool(SPREADSHEET_ID, TOKEN_REFRESH_MARGIN)
+
+
+# ====== 資料來源 ======
+# gsheets（預設）= Google 試算表；folder = DATA_PATH 資料夾裡的 CSV / XLSX；
+# parquet = DATA_PATH 的 Parquet 檔或資料夾（pandas 讀取，需安裝 pyarrow）
+DATA_SOURCE = os.getenv("DATA_SOURCE", "gsheets")
+DATA_PATH = os.getenv("DATA_PATH", str(BASE_DIR / 'data'))
+
+# 每個 backend 提供：
+#   key        辨識資料來源的字串（快照檔用來確認是不是同一份資料）
+#   modified() 便宜的變更標記，與上次相同就不必重讀；取不到回 None
+#   sheets()   依順序回傳 [(工作表名稱, 表頭, 資料列), ...]；
+#              讀不到的分頁在原位置放 SheetFetchError，其他分頁照常使用
+
+# 平行讀取的執行緒上限（別超過 API 配額）
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+# 每次 batchGet 帶幾個分頁；0 = 全部分頁一次讀完（每次重讀只花一個讀取配額）
+FETCH_BATCH_SIZE = int(os.getenv("FETCH_BATCH_SIZE", "0"))
+
+
+class SheetFetchError(Exception):
+  """單一分頁（或檔案）讀取失敗。"""
+
+  def __init__(self, title, error):
+    super().__init__(f"{title}: {error!r}")
+    self.title = title
+    self.error = error
+
+
+def map_bounded(fn, items) -> list:
+  """
+    以最多 FETCH_CONCURRENCY 條執行緒平行執行 fn(item)，結果依 items 原順序回傳；
+    某一項失敗時該位置放例外物件，不影響其他項目。
+    """
+  items = list(items)
+  if not items:
+    return []
+  workers = max(1, min(FETCH_CONCURRENCY, len(items)))
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(fn, item) for item in items]
+  return [f.exception() or f.result() for f in futures]
+
+
+def _cell_value(v):
+  """空值（None / NaN）一律當空字串，其餘原樣交給 SheetTable 清理。"""
+  if v is None or (isinstance(v, float) and v != v):
+    return ''
+  return v
+
+
+def files_signature(paths) -> str:
+  """各檔案名稱、大小、修改時間的雜湊（本機檔案的變更標記）。"""
+  stats = [(p.name, p.stat().st_size, p.stat().st_mtime_ns) for p in paths]
+  return hashlib.sha1(repr(stats).encode('utf-8')).hexdigest()
+
+
+def fetch_all_values(ss):
+  """
+    預設所有分頁一次 values_batch_get；有設 FETCH_BATCH_SIZE 才分組、各組平行讀取。
+    某組失敗（非配額問題）時改逐頁平行重讀，把失敗限縮到出問題的分頁。
+    回傳 [(分頁名稱, values) 或 SheetFetchError, ...]，維持分頁原順序。
+    """
+  titles = [sh.title for sh in ss.worksheets()]
+  metrics.incr('google.worksheets')
+  size = FETCH_BATCH_SIZE if FETCH_BATCH_SIZE > 0 else max(1, len(titles))
+  chunks = [titles[i:i + size] for i in range(0, len(titles), size)]
+
+  def fetch(chunk):
+    metrics.incr('google.values_batch_get')
+    ranges = [absolute_range_name(t) for t in chunk]
+    value_ranges = ss.values_batch_get(ranges).get('valueRanges', [])
+    return [vr.get('values', []) for vr in value_ranges]
+
+  sheets = []
+  for chunk, got in zip(chunks, map_bounded(fetch, chunks)):
+    if isinstance(got, Exception):
+      if len(chunk) > 1 and not is_retryable(got):
+        got = [
+            v if isinstance(v, Exception) else v[0]
+            for v in map_bounded(fetch, [[t] for t in chunk])
+        ]
+      else:
+        got = [got] * len(chunk)
+    for title, values in zip(chunk, got):
+      if isinstance(values, Exception):
+        sheets.append(SheetFetchError(title, values))
+      else:
+        sheets.append((title, values))
+  return sheets
+
+
+def spreadsheet_modified_time(ss):
+  """試算表在 Drive 上的 modifiedTime（需要 drive.readonly scope）；取不到回 None。"""
+  try:
+    metrics.incr('google.modified_time')
+    return ss.get_lastUpdateTime()
+  except Exception as e:
+    # 配額 / 暫時性錯誤交給上層退避重試；其他（例如沒開 Drive API）就整本重讀
+    if is_retryable(e):
+      raise
+    print("[snapshot] modifiedTime unavailable:", repr(e))
+    return None
+
+
+class GoogleSheetsBackend:
+  """Google 試算表（原本的讀法）：Drive modifiedTime 當變更標記，一次批次讀完所有分頁。"""
+
+  def __init__(self, pool, spreadsheet_id):
+    self._pool = pool
+    self.key = f"gsheets:{spreadsheet_id}"
+
+  def modified(self):
+    return self._call(spreadsheet_modified_time)
+
+  def sheets(self):
+    return [
+        s if isinstance(s, SheetFetchError) else
+        (s[0], s[1][0] if s[1] else [], s[1][1:])
+        for s in self._call(fetch_all_values)
+    ]
+
+  def _call(self, fn):
+    try:
+      return fn(self._pool.open())
+    except gspread.exceptions.APIError as e:
+      # 401/403 多半是 token 或分享設定變了：下次重新授權
+      if e.response.status_code in (401, 403):
+        self._pool.reset()
+      raise
+
+
+class FolderBackend:
+  """
+    資料夾裡每個 CSV 檔是一個工作表（名稱取檔名），
+    XLSX 檔的每個分頁各是一個工作表（名稱取分頁名稱，與從 Google 下載的檔案一致）。
+    """
+  SUFFIXES = ('.csv', '.xlsx')
+
+  def __init__(self, path):
+    self._path = Path(path)
+    self.key = f"folder:{self._path.resolve()}"
+
+  def _files(self):
+    return sorted(p for p in self._path.iterdir()
+                  if p.suffix.lower() in self.SUFFIXES and
+                  not p.name.startswith(('.', '~$')))
+
+  def modified(self):
+    return files_signature(self._files())
+
+  def sheets(self):
+    """各檔案平行讀取；讀不到的檔案以 SheetFetchError 回報（名稱取檔名）。"""
+    files = self._files()
+    sheets = []
+    for p, got in zip(files, map_bounded(self._read, files)):
+      if isinstance(got, Exception):
+        sheets.append(SheetFetchError(p.stem, got))
+      else:
+        sheets.extend(got)
+    return sheets
+
+  def _read(self, p):
+    metrics.incr('file.read')
+    if p.suffix.lower() == '.csv':
+      return [self._read_csv(p)]
+    return self._read_xlsx(p)
+
+  @staticmethod
+  def _read_csv(p):
+    with open(p, newline='', encoding='utf-8-sig') as f:
+      values = list(csv.reader(f))
+    return p.stem, values[0] if values else [], values[1:]
+
+  @staticmethod
+  def _read_xlsx(p):
+    try:
+      import openpyxl
+    except ImportError:
+      raise RuntimeError("讀取 XLSX 需要 openpyxl：pip install openpyxl")
+    wb = openpyxl.load_workbook(p, read_only=True, data_only=True)
+    try:
+      sheets = []
+      for ws in wb.worksheets:
+        values = [[_cell_value(v) for v in row]
+                  for row in ws.iter_rows(values_only=True)]
+        sheets.append((ws.title, list(values[0]) if values else [], values[1:]))
+      return sheets
+    finally:
+      wb.close()
+
+
+class ParquetBackend:
+  """Parquet 檔（或資料夾裡的每個 .parquet 檔）各是一個工作表，名稱取檔名。"""
+
+  def __init__(self, path):
+    self._path = Path(path)
+    self.key = f"parquet:{self._path.resolve()}"
+
+  def _files(self):
+    if self._path.is_file():
+      return [self._path]
+    return sorted(self._path.glob('*.parquet'))
+
+  def modified(self):
+    return files_signature(self._files())
+
+  def sheets(self):
+    try:
+      import pandas as pd
+    except ImportError:
+      raise RuntimeError("讀取 Parquet 需要 pandas 與 pyarrow：pip install pandas pyarrow")
+
+    def read(p):
+      metrics.incr('file.read')
+      df = pd.read_parquet(p)
+      df = df.astype(object).where(df.notna(), None)
+      rows = [[_cell_value(v) for v in row]
+              for row in df.itertuples(index=False, name=None)]
+      return p.stem, [str(c) for c in df.columns], rows
+
+    files = self._files()
+    return [
+        SheetFetchError(p.stem, got) if isinstance(got, Exception) else got
+        for p, got in zip(files, map_bounded(read, files))
+    ]
+
+
+def make_backend():
+  if DATA_SOURCE == 'folder':
+    return FolderBackend(DATA_PATH)
+  if DATA_SOURCE == 'parquet':
+    return ParquetBackend(DATA_PATH)
+  if DATA_SOURCE != 'gsheets':
+    raise ValueError(f"未知的 DATA_SOURCE：{DATA_SOURCE}（gsheets / folder / parquet）")
+  return GoogleSheetsBackend(client_pool, SPREADSHEET_ID)
+
+
+backend = make_backend()
+
+
 def is_type_col(colname: str) -> bool:
   colname = (colname or "").strip().lower().replace(" ", "")
   return colname in ['type', 'tpye', 'typ', 'tpy', 'tpey', 'tpye']
@@ -80,97 +493,1563 @@ def clean_cell(val) -> str:
   return s
 
 
+# ====== 資料整理與關鍵字索引（載入快照時做一次） ======
+SOURCE_COL = '來源工作表'
+_FROM_SOURCE = -1  # 欄位值取工作表名稱
+_BLANK = None  # 欄位不存在，值為空字串
+
+
+class NgramIndex:
+  """
+    以 1～3 字元 n-gram 建的倒排索引，中英混合都能做子字串搜尋（不需斷詞）。
+    關鍵字 ≤ 3 字時，posting list 就是答案；較長時取最少見的 n-gram 當候選，
+    再逐筆確認欄位裡真的包含關鍵字。n-gram 不跨欄位，結果與逐格比對相同。
+    """
+  N = 3
+
+  def __init__(self, columns, size):
+    # columns：各欄的小寫字串，每欄長度皆為 size
+    self.columns = columns
+    postings = {}
+    for row_id in range(size):
+      grams = set()
+      for col in columns:
+        grams.update(self._grams(col[row_id], self.N))
+      for gram in grams:
+        postings.setdefault(gram, []).append(row_id)
+    self.postings = {gram: array('I', ids) for gram, ids in postings.items()}
+
+  @staticmethod
+  def _grams(text, n_max):
+    size = len(text)
+    for n in range(1, n_max + 1):
+      for i in range(size - n + 1):
+        yield text[i:i + n]
+
+  def search(self, needle):
+    """回傳欄位值包含 needle（已轉小寫）的列編號，依原順序。"""
+    if not needle:
+      return []
+    if len(needle) <= self.N:
+      return list(self.postings.get(needle, ()))
+    n = self.N
+    rarest = None
+    for i in range(len(needle) - n + 1):
+      ids = self.postings.get(needle[i:i + n])
+      if ids is None:
+        return []
+      if rarest is None or len(ids) < len(rarest):
+        rarest = ids
+    columns = self.columns
+    return [i for i in rarest if any(needle in col[i] for col in columns)]
+
+
+# /api/suggest 預設回傳幾筆建議；limit 參數上限 SUGGEST_MAX
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "10"))
+SUGGEST_MAX = 50
+
+
+def normalize_prefix(text) -> str:
+  """前綴索引用的正規化：小寫、連續空白併成一個。"""
+  return ' '.join(text.lower().split())
+
+
+class SuggestIndex:
+  """
+    Title / Company 的前綴索引：正規化後的值排成有序陣列，前綴查詢就是 bisect 出一段範圍，
+    再依筆數取前 N 名。每個詞的開頭也各放一份（打「索尼」找得到「Sony 索尼」）。
+    1～2 字的前綴範圍可能很大，這些前綴的前 SUGGEST_MAX 名在建索引時先算好。
+    """
+  SHORT = 2
+
+  def __init__(self, counts):
+    # counts：(kind, 值) → 筆數，kind 為 'company' / 'title'；筆數多的排前面
+    ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    self.entries = [(kind, value, n) for (kind, value), n in ranked]
+    keyed = []
+    self.top = {}  # 短前綴 → 排名（已由小到大）
+    for rank, (_, value, _) in enumerate(self.entries):
+      key = normalize_prefix(value)
+      for i, ch in enumerate(key):
+        if i and key[i - 1] != ' ' or ch == ' ':
+          continue
+        word = key[i:]
+        keyed.append((word, rank))
+        for n in range(1, self.SHORT + 1):
+          ranks = self.top.setdefault(word[:n], [])
+          if len(ranks) < SUGGEST_MAX and (not ranks or ranks[-1] != rank):
+            ranks.append(rank)
+    keyed.sort()
+    self.keys = [k for k, _ in keyed]
+    self.ranks = array('I', [rank for _, rank in keyed])
+
+  def suggest(self, prefix, limit=SUGGEST_LIMIT) -> list:
+    """回傳 [(kind, 值, 筆數)]，筆數多的在前。"""
+    key = normalize_prefix(prefix)
+    if not key:
+      return []
+    if len(key) <= self.SHORT:
+      ranks = self.top.get(key, [])[:limit]
+    else:
+      lo = bisect.bisect_left(self.keys, key)
+      hi = bisect.bisect_left(self.keys, key + '\U0010ffff', lo)
+      ranks = heapq.nsmallest(limit, set(self.ranks[lo:hi]))
+    return [self.entries[rank] for rank in ranks]
+
+
+class Row(Mapping):
+  """
+    一列結果：值存成 tuple，欄名 → 位置的對照表由同一工作表的所有列共用，
+    不必每列各帶一份欄名。介面同唯讀 dict（get / items / []），要輸出 JSON 時 dict(row)。
+    """
+  __slots__ = ('_field_pos', '_values')
+
+  def __init__(self, field_pos, values):
+    self._field_pos = field_pos
+    self._values = values
+
+  def __getitem__(self, key):
+    return self._values[self._field_pos[key]]
+
+  def get(self, key, default=None):
+    pos = self._field_pos.get(key)
+    return default if pos is None else self._values[pos]
+
+  def __iter__(self):
+    return iter(self._field_pos)
+
+  def __len__(self):
+    return len(self._values)
+
+  def __repr__(self):
+    return f"Row({dict(self)!r})"
+
+
+class SheetTable:
+  """
+    單一工作表整理後的欄式資料（只保留 Title & Video url 皆有值的列）。
+    每個儲存格只在這裡清理一次，字串用 sys.intern 共用；
+    Type / Company / Title / Video url / 來源工作表 對應哪一欄，讀表頭時就決定好。
+    """
+
+  def __init__(self, title, header, rows, digest=''):
+    self.title = title
+    self.digest = digest
+    self.source = sys.intern(clean_cell(title))
+    width = max([len(header)] + [len(r) for r in rows])
+    header = list(header) + [''] * (width - len(header))
+
+    # 與 dict(zip(header, row)) 一致：欄名重複時位置取第一次、值取最後一欄
+    key_pos = {}
+    for pos, k in enumerate(header):
+      key_pos[k] = pos
+    self.header = list(key_pos)
+    type_key = next((k for k in key_pos if is_type_col(k)), None)
+    company_key = next((k for k in key_pos if is_company_col(k)), None)
+    self.type_pos = key_pos[type_key] if type_key is not None else None
+    title_pos = key_pos.get('Title')
+    url_pos = key_pos.get('Video url')
+
+    # 欄名 → 來源欄位；Type、Company、來源工作表 統一欄名
+    schema = dict(key_pos)
+    if self.type_pos is not None:
+      schema['Type'] = self.type_pos
+    schema['Company'] = (key_pos[company_key]
+                         if company_key is not None else _BLANK)
+    schema[SOURCE_COL] = _FROM_SOURCE
+    # 比對範圍含其他 Type 原欄；顯示時只保留 'Type'
+    match_pos = sorted({p for p in schema.values() if p is not None and p >= 0})
+    self.fields = [k for k in schema if not (is_type_col(k) and k != 'Type')]
+    self.positions = [schema[k] for k in self.fields]
+    self.schema = dict(zip(self.fields, self.positions))
+    self._field_pos = {k: i for i, k in enumerate(self.fields)}
+
+    # 清理一次、存成欄式；另外蒐集所有非空列的 Type（含沒有 Title 的列）
+    self.types = []
+    seen_types = set()
+    self.record_count = 0
+    self.size = 0
+    cols = {pos: [] for pos in match_pos}
+    pad = [''] * width
+    for raw in rows:
+      cells = [
+          clean_cell(v)
+          for v in numericise_all(list(raw) + pad[:width - len(raw)])
+      ]
+      if not any(cells):
+        continue
+      self.record_count += 1
+      if self.type_pos is not None:
+        tv = cells[self.type_pos]
+        if tv and tv not in seen_types:
+          seen_types.add(tv)
+          self.types.append(sys.intern(tv))
+      if title_pos is None or url_pos is None:
+        continue
+      if not cells[title_pos] or not cells[url_pos]:
+        continue
+      for pos, col in cols.items():
+        col.append(sys.intern(cells[pos]))
+      self.size += 1
+    self.columns = cols
+
+    # Type 值 → 列編號、Company 值 → 列編號、(Type, Company) → 筆數
+    self.type_ids = {}
+    self.company_ids = {}
+    self.type_company = {}
+    company_pos = self.schema['Company']
+    if company_pos is not _BLANK:
+      for row_id, c in enumerate(cols[company_pos]):
+        if c:
+          self.company_ids.setdefault(c, []).append(row_id)
+    if self.type_pos is not None:
+      for row_id, tv in enumerate(cols[self.type_pos]):
+        if tv:
+          self.type_ids.setdefault(tv, []).append(row_id)
+          c = self.value(company_pos, row_id)
+          if c:
+            self.type_company[tv, c] = self.type_company.get((tv, c), 0) + 1
+
+    lower = [[sys.intern(v.lower()) for v in cols[pos]] for pos in match_pos]
+    self.index = NgramIndex(lower, self.size)
+    self._source_lower = self.source.lower()
+
+  def search(self, needle):
+    """回傳此工作表中符合關鍵字（小寫）的列編號。"""
+    if needle and needle in self._source_lower:
+      return range(self.size)
+    return self.index.search(needle)
+
+  def value(self, pos, row_id):
+    if pos is _BLANK:
+      return ''
+    if pos == _FROM_SOURCE:
+      return self.source
+    return self.columns[pos][row_id]
+
+  def get(self, row_id, field, default=''):
+    """單一欄位的值（不組整列 dict）。"""
+    if field not in self.schema:
+      return default
+    return self.value(self.schema[field], row_id)
+
+  def values(self, field, row_ids) -> list:
+    """多列同一欄的值（不組整列 dict）。"""
+    pos = self.schema.get(field, _BLANK)
+    if pos is _BLANK:
+      return [''] * len(row_ids)
+    if pos == _FROM_SOURCE:
+      return [self.source] * len(row_ids)
+    col = self.columns[pos]
+    return [col[i] for i in row_ids]
+
+  def values_of(self, fields, row_ids) -> list:
+    """多列多欄的值（每欄一個 list）。"""
+    return [self.values(field, row_ids) for field in fields]
+
+  def ids_of(self, field, values) -> list:
+    """Type / Company 欄等於 values 其中之一的列編號（遞增）。"""
+    lists = self.type_ids if field == 'Type' else self.company_ids
+    found = [lists[v] for v in values if v in lists]
+    if len(found) == 1:
+      return found[0]
+    return sorted(i for row_ids in found for i in row_ids)
+
+  def value_counts(self, field) -> dict:
+    """某欄每個值有幾列（不含空值）。"""
+    if field in ('Type', 'Company'):
+      lists = self.type_ids if field == 'Type' else self.company_ids
+      return {v: len(row_ids) for v, row_ids in lists.items()}
+    pos = self.schema.get(field, _BLANK)
+    counts = {}
+    if pos is _BLANK:
+      return counts
+    for row_id in range(self.size):
+      v = self.value(pos, row_id)
+      if v:
+        counts[v] = counts.get(v, 0) + 1
+    return counts
+
+  def row(self, row_id) -> Row:
+    """組出搜尋結果的一列（與其他列共用欄名對照表）。"""
+    return Row(self._field_pos,
+               tuple([self.value(pos, row_id) for pos in self.positions]))
+
+  def db_rows(self, base):
+    """快照檔 rows 表的內容：(gid, 列資料 JSON, Type, Company, 搜尋文字)。"""
+    lower = self.index.columns
+    return ((base + i,
+             json.dumps([self.value(p, i) for p in self.positions],
+                        ensure_ascii=False),
+             self.get(i, 'Type'),
+             self.get(i, 'Company'),
+             _TEXT_SEP.join(col[i] for col in lower))
+            for i in range(self.size))
+
+
+# ====== 資料快照（整本試算表讀一次，放在記憶體共用） ======
+# 快照存活秒數；超過就在背景重新讀取，期間仍用舊資料回應（0 = 不自動更新）
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", "300"))
+
+
+class Snapshot:
+  """
+    某一時間點所有工作表整理後的內容（唯讀，不要就地修改）。
+    列以全域編號表示：依工作表順序、再依列順序連續編號。
+    """
+
+  def __init__(self, version, tables, modified=None, errors=None):
+    self.version = version
+    self.tables = tables
+    self.modified = modified  # 資料來源的變更標記（Google 為 Drive modifiedTime）
+    self.errors = errors or {}  # 這次沒讀到的分頁 → 錯誤訊息（沿用舊資料）
+    # 冷啟動時從快照檔開、暫時頂著用的快照：下一次更新一定改建記憶體索引
+    self.bridge = False
+    # 內容雜湊：由各分頁雜湊組成，給 ETag 用
+    self.digest = hashlib.sha1('\n'.join(
+        t.title + '\t' + t.digest for t in tables).encode('utf-8')).hexdigest()
+    self.loaded_at = time.time()
+    self.checked_at = self.loaded_at
+    self.bases = []
+    total = 0
+    for t in tables:
+      self.bases.append(total)
+      total += t.size
+    self.size = total
+    self.types, seen = [], set()
+    for t in tables:
+      for tv in t.types:
+        if tv not in seen:
+          seen.add(tv)
+          self.types.append(tv)
+    self._facets = None
+    self._suggest = None
+    self._avg_lengths = {}
+
+  def age(self) -> float:
+    """距離上次向 Google 確認資料的秒數。"""
+    return time.time() - self.checked_at
+
+  def search(self, needle):
+    """關鍵字（小寫）比對任一欄位，回傳全域列編號（遞增）。"""
+    ids = []
+    for base, t in zip(self.bases, self.tables):
+      ids.extend(base + i for i in t.search(needle))
+    return ids
+
+  def type_ids(self, type_val):
+    ids = []
+    for base, t in zip(self.bases, self.tables):
+      ids.extend(base + i for i in t.ids_of('Type', [type_val]))
+    return ids
+
+  def company_ids(self, company):
+    ids = []
+    for base, t in zip(self.bases, self.tables):
+      ids.extend(base + i for i in t.ids_of('Company', [company]))
+    return ids
+
+  def value_ids(self, field, needle):
+    """Type / Company 欄的值包含 needle（小寫）的列：先挑出符合的值，再查這些值的列。"""
+    ids = []
+    for base, t in zip(self.bases, self.tables):
+      values = [v for v in t.value_counts(field) if needle in v.lower()]
+      if values:
+        ids.extend(base + i for i in t.ids_of(field, values))
+    return ids
+
+  def sheet_ids(self, needle):
+    """工作表名稱包含 needle（小寫）的所有列。"""
+    ids = []
+    for base, t in zip(self.bases, self.tables):
+      if needle in t.source.lower():
+        ids.extend(range(base, base + t.size))
+    return ids
+
+  def facets(self) -> dict:
+    """
+      Type、Company、Type × Company 的筆數（只算有 Title & Video url 的列）；
+      由各分頁的筆數彙總（快照檔用 GROUP BY，不讀出列編號），第一次用到才算。
+      """
+    if self._facets is None:
+      types, companies, pairs = {}, {}, {}
+      for t in self.tables:
+        for tv, n in t.value_counts('Type').items():
+          types[tv] = types.get(tv, 0) + n
+        for c, n in t.value_counts('Company').items():
+          companies[c] = companies.get(c, 0) + n
+        for (tv, c), n in t.type_company.items():
+          counts = pairs.setdefault(tv, {})
+          counts[c] = counts.get(c, 0) + n
+      self._facets = {
+          "types": {tv: types.get(tv, 0) for tv in self.types},
+          "companies": companies,
+          "type_company": pairs,
+      }
+    return self._facets
+
+  def avg_length(self, field) -> float:
+    """某欄非空值的平均字數（BM25 的長度正規化用），第一次用到才算。"""
+    if field not in self._avg_lengths:
+      chars = count = 0
+      for t in self.tables:
+        for value, n in t.value_counts(field).items():
+          chars += len(value) * n
+          count += n
+      self._avg_lengths[field] = chars / count if count else 0.0
+    return self._avg_lengths[field]
+
+  def suggestions(self) -> SuggestIndex:
+    """Title / Company 的前綴索引；SnapshotStore 換上新快照前就先建好。"""
+    if self._suggest is None:
+      counts = {}
+      for t in self.tables:
+        for kind, field in (('company', 'Company'), ('title', 'Title')):
+          for value, n in t.value_counts(field).items():
+            counts[kind, value] = counts.get((kind, value), 0) + n
+      self._suggest = SuggestIndex(counts)
+    return self._suggest
+
+  def locate(self, gid):
+    k = bisect.bisect_right(self.bases, gid) - 1
+    return self.tables[k], gid - self.bases[k]
+
+  def row(self, gid) -> Row:
+    table, row_id = self.locate(gid)
+    return table.row(row_id)
+
+
+# ====== 本機快照檔（SQLite + FTS5，新 instance 開檔即可回應） ======
+# 空字串 = 不使用；Vercel / Cloud Run 只有暫存目錄可寫，也可指向部署時一起打包的檔案
+SNAPSHOT_DB = os.getenv(
+    "SNAPSHOT_DB", os.path.join(tempfile.gettempdir(), 'arete-snapshot.sqlite3'))
+# 檔案格式版本；欄位結構改了就加一，舊檔會被忽略
+SNAPSHOT_DB_FORMAT = '3'
+# 快照檔以 mmap 讀取的上限（bytes）
+SNAPSHOT_MMAP_SIZE = int(os.getenv("SNAPSHOT_MMAP_SIZE", "268435456"))
+_TEXT_SEP = '\x1f'  # 搜尋文字裡分隔各欄，避免關鍵字跨欄命中
+_SQL_BATCH = 500  # 一次 IN (...) 查詢的列數（SQLite 的參數個數有上限）
+
+SNAPSHOT_DB_SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE sheets (
+  pos INTEGER PRIMARY KEY, title TEXT, digest TEXT, base INTEGER,
+  size INTEGER, record_count INTEGER, header TEXT, fields TEXT, types TEXT
+);
+CREATE TABLE rows (
+  gid INTEGER PRIMARY KEY, data TEXT, type TEXT, company TEXT, text TEXT
+);
+CREATE INDEX rows_type ON rows (type, gid);
+CREATE INDEX rows_company ON rows (company, gid);
+CREATE VIRTUAL TABLE rows_fts USING fts5(
+  text, content='rows', content_rowid='gid', tokenize='trigram'
+);
+CREATE TABLE suggest (
+  rank INTEGER PRIMARY KEY, kind TEXT, value TEXT, n INTEGER
+);
+CREATE TABLE suggest_keys (
+  key TEXT, rank INTEGER, PRIMARY KEY (key, rank)
+) WITHOUT ROWID;
+CREATE TABLE suggest_top (
+  prefix TEXT, rank INTEGER, PRIMARY KEY (prefix, rank)
+) WITHOUT ROWID;
+'''
+
+
+class StoredTable:
+  """
+    快照檔裡的一個工作表，介面與 SheetTable 相同；
+    列資料與搜尋都直接查 SQLite（關鍵字走 FTS5 trigram 索引）。
+    """
+
+  # 有自己欄位的值直接讀欄位，不必解 JSON
+  _COLUMNS = {'Type': 'type', 'Company': 'company'}
+
+  def __init__(self, conn, title, digest, base, size, record_count, header,
+               fields, types):
+    self._conn = conn
+    self._base = base
+    self.title = title
+    self.digest = digest
+    self.source = sys.intern(clean_cell(title))
+    self.size = size
+    self.record_count = record_count
+    self.header = json.loads(header)
+    self.fields = json.loads(fields)
+    self.types = json.loads(types)
+    self._field_pos = {k: i for i, k in enumerate(self.fields)}
+    self._source_lower = self.source.lower()
+    self._counts = {}  # Type / Company → {值: 筆數}
+    self._type_company = None
+
+  def ids_of(self, field, values) -> list:
+    """同 SheetTable.ids_of，查 rows_type / rows_company 索引。"""
+    column = self._COLUMNS[field]
+    values = list(values)
+    ids = []
+    for start in range(0, len(values), _SQL_BATCH):
+      batch = values[start:start + _SQL_BATCH]
+      ids.extend(gid - self._base for (gid,) in self._conn.execute(
+          f"SELECT gid FROM rows WHERE {column} IN "
+          f"({', '.join('?' * len(batch))}) AND gid BETWEEN ? AND ?",
+          (*batch, *self._bounds())))
+    ids.sort()
+    return ids
+
+  @property
+  def type_company(self):
+    """(Type, Company) → 筆數（依第一次出現的順序，與記憶體索引相同）。"""
+    if self._type_company is None:
+      self._type_company = {
+          (tv, c): n for tv, c, n in self._conn.execute(
+              "SELECT type, company, count(*) FROM rows "
+              "WHERE gid BETWEEN ? AND ? AND type != '' AND company != '' "
+              "GROUP BY type, company ORDER BY min(gid)", self._bounds())
+      }
+    return self._type_company
+
+  def _bounds(self):
+    return self._base, self._base + self.size - 1
+
+  def search(self, needle):
+    """回傳此工作表中符合關鍵字（小寫）的列編號。"""
+    if not needle:
+      return []
+    if needle in self._source_lower:
+      return range(self.size)
+    if len(needle) >= 3:
+      # trigram 片語查詢即子字串比對；instr 再確認一次，結果與記憶體索引相同
+      rows = self._conn.execute(
+          "SELECT rowid FROM rows_fts WHERE rows_fts MATCH ? "
+          "AND rowid BETWEEN ? AND ? AND instr(text, ?) > 0 ORDER BY rowid",
+          ('"' + needle.replace('"', '""') + '"', *self._bounds(), needle))
+    else:
+      # 1～2 字無法用 trigram，直接掃這個工作表的列
+      rows = self._conn.execute(
+          "SELECT gid FROM rows WHERE gid BETWEEN ? AND ? "
+          "AND instr(text, ?) > 0 ORDER BY gid", (*self._bounds(), needle))
+    return [gid - self._base for (gid,) in rows]
+
+  def _values(self, row_id):
+    (data,) = self._conn.execute("SELECT data FROM rows WHERE gid = ?",
+                                 (self._base + row_id,)).fetchone()
+    return json.loads(data)
+
+  def get(self, row_id, field, default=''):
+    """單一欄位的值（不組整列 dict）。"""
+    pos = self._field_pos.get(field)
+    if pos is None:
+      return default
+    return self._values(row_id)[pos]
+
+  def values(self, field, row_ids) -> list:
+    """多列同一欄的值（只查這些列）。"""
+    return self.values_of((field,), row_ids)[0]
+
+  def values_of(self, fields, row_ids) -> list:
+    """多列多欄的值（每欄一個 list）；只查這些列，每批一次查詢、各欄一起讀。"""
+    exprs, slots = [], []
+    for field in fields:
+      pos = self._field_pos.get(field)
+      if pos is None:
+        slots.append(None)
+        continue
+      exprs.append(
+          self._COLUMNS.get(field) or f"json_extract(data, '$[{pos}]')")
+      slots.append(len(exprs))
+    found = {}
+    if exprs and row_ids:
+      select = f"SELECT gid, {', '.join(exprs)} FROM rows WHERE gid IN "
+      for start in range(0, len(row_ids), _SQL_BATCH):
+        batch = [self._base + i for i in row_ids[start:start + _SQL_BATCH]]
+        found.update((r[0], r) for r in self._conn.execute(
+            select + f"({', '.join('?' * len(batch))})", batch))
+    rows = [found[self._base + i] for i in row_ids] if exprs else ()
+    return [[r[slot] for r in rows] if slot else [''] * len(row_ids)
+            for slot in slots]
+
+  def value_counts(self, field) -> dict:
+    """某欄每個值有幾列（不含空值）。"""
+    if field in self._COLUMNS:
+      # Type / Company 的值不多：GROUP BY 一次後留著，依第一次出現的順序
+      if field not in self._counts:
+        self._counts[field] = {
+            v: n for v, n in self._conn.execute(
+                f"SELECT {self._COLUMNS[field]} AS v, count(*) FROM rows "
+                "WHERE gid BETWEEN ? AND ? GROUP BY v ORDER BY min(gid)",
+                self._bounds()) if v
+        }
+      return self._counts[field]
+    pos = self._field_pos.get(field)
+    if pos is None:
+      return {}
+    return {
+        v: n for v, n in self._conn.execute(
+            f"SELECT json_extract(data, '$[{pos}]') AS v, count(*) FROM rows "
+            "WHERE gid BETWEEN ? AND ? GROUP BY v", self._bounds()) if v
+    }
+
+  def row(self, row_id) -> Row:
+    """組出搜尋結果的一列（與其他列共用欄名對照表）。"""
+    return Row(self._field_pos, tuple(self._values(row_id)))
+
+  def db_rows(self, base):
+    """同 SheetTable.db_rows：直接從來源快照檔複製，換成新的列編號。"""
+    return self._conn.execute(
+        "SELECT gid - ? + ?, data, type, company, text FROM rows "
+        "WHERE gid BETWEEN ? AND ? ORDER BY gid",
+        (self._base, base, *self._bounds()))
+
+
+class StoredSuggestIndex:
+  """
+    快照檔裡的前綴索引，介面與 SuggestIndex 相同：
+    有序的前綴鍵存在 suggest_keys（主鍵即索引），前綴查詢是一段範圍查詢；
+    短前綴的前幾名存在 suggest_top。開檔不必把索引讀進記憶體。
+    """
+  SHORT = SuggestIndex.SHORT
+
+  def __init__(self, conn):
+    self._conn = conn
+
+  def suggest(self, prefix, limit=SUGGEST_LIMIT) -> list:
+    """回傳 [(kind, 值, 筆數)]，筆數多的在前。"""
+    key = normalize_prefix(prefix)
+    if not key:
+      return []
+    if len(key) <= self.SHORT:
+      ranks = ("SELECT rank FROM suggest_top WHERE prefix = ? "
+               "ORDER BY rank LIMIT ?", (key, limit))
+    else:
+      ranks = ("SELECT DISTINCT rank FROM suggest_keys "
+               "WHERE key >= ? AND key < ? ORDER BY rank LIMIT ?",
+               (key, key + '\U0010ffff', limit))
+    return self._conn.execute(
+        "SELECT kind, value, n FROM suggest "
+        f"WHERE rank IN ({ranks[0]}) ORDER BY rank", ranks[1]).fetchall()
+
+
+class StoredSnapshot(Snapshot):
+  """從快照檔開啟的快照；checked_at 是寫檔時間，過期就照常在背景向 Google 確認。"""
+
+  def __init__(self, conn, path, file_id=None):
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    tables = [
+        StoredTable(conn, *r) for r in conn.execute(
+            "SELECT title, digest, base, size, record_count, header, fields, "
+            "types FROM sheets ORDER BY pos")
+    ]
+    super().__init__(int(meta['version']), tables, meta['modified'])
+    self.checked_at = float(meta['saved_at'])
+    self.path = path
+    self.file_id = file_id  # 開檔時的 inode / mtime，用來發現檔案被換掉
+    # 前綴建議直接查檔案，每個 worker 不必各建一份索引
+    self._suggest = StoredSuggestIndex(conn)
+
+
+def file_identity(path):
+  """檔案的 (inode, mtime, size)；os.replace 換檔後一定會變。"""
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+  return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def open_stored_snapshot(path=SNAPSHOT_DB):
+  """
+    開啟快照檔（唯讀、mmap）；沒有檔案、格式不符或不是這份資料來源就回 None。
+    同一個檔被多個 process 開啟時，mmap 的頁面由 OS 共用，不會各存一份。
+    """
+  file_id = file_identity(path) if path else None
+  if file_id is None:
+    return None
+  try:
+    uri = Path(path).resolve().as_uri() + '?mode=ro&immutable=1'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {SNAPSHOT_MMAP_SIZE}")
+    meta = dict(conn.execute("SELECT key, value FROM meta"))
+    if (meta.get('format') != SNAPSHOT_DB_FORMAT or
+        meta.get('source') != backend.key):
+      conn.close()
+      return None
+    snap = StoredSnapshot(conn, path, file_id)
+  except Exception as e:
+    print("[snapshot] stored snapshot unusable:", repr(e))
+    return None
+  print(f"[snapshot] opened {path} (version {snap.version}, {snap.size} rows)")
+  return snap
+
+
+def save_snapshot(snap, path=SNAPSHOT_DB):
+  """
+    把快照寫成 SQLite 檔：先寫暫存檔再 os.replace，
+    其他 process 不會讀到寫一半的檔，已開啟舊檔的連線也不受影響。
+    """
+  if not path:
+    return
+  tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+  started = time.time()
+  try:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+      with conn:
+        conn.executescript(SNAPSHOT_DB_SCHEMA)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+            ('format', SNAPSHOT_DB_FORMAT),
+            ('source', backend.key),
+            ('version', str(snap.version)),
+            ('modified', snap.modified),
+            ('saved_at', repr(snap.checked_at)),
+        ])
+        for pos, (base, t) in enumerate(zip(snap.bases, snap.tables)):
+          conn.execute(
+              "INSERT INTO sheets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              (pos, t.title, t.digest, base, t.size, t.record_count,
+               json.dumps(t.header, ensure_ascii=False),
+               json.dumps(t.fields, ensure_ascii=False),
+               json.dumps(t.types, ensure_ascii=False)))
+          # 從快照檔沿用的分頁（冷啟動後讀取失敗）直接複製原檔的列
+          conn.executemany("INSERT INTO rows VALUES (?, ?, ?, ?, ?)",
+                           t.db_rows(base))
+        conn.execute("INSERT INTO rows_fts(rows_fts) VALUES ('rebuild')")
+        suggest = snap.suggestions()
+        conn.executemany("INSERT INTO suggest VALUES (?, ?, ?, ?)",
+                         ((rank, *entry)
+                          for rank, entry in enumerate(suggest.entries)))
+        conn.executemany("INSERT OR IGNORE INTO suggest_keys VALUES (?, ?)",
+                         zip(suggest.keys, suggest.ranks))
+        conn.executemany("INSERT INTO suggest_top VALUES (?, ?)",
+                         ((prefix, rank)
+                          for prefix, ranks in suggest.top.items()
+                          for rank in ranks))
+    finally:
+      conn.close()
+    os.replace(tmp, path)
+  except Exception as e:
+    print("[snapshot] save failed:", repr(e))
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    return
+  metrics.observe('snapshot_save', (time.time() - started) * 1000)
+  print(f"[snapshot] saved version {snap.version} to {path} "
+        f"in {time.time() - started:.2f}s")
+
+
+def values_digest(values) -> str:
+  """分頁內容的雜湊，用來判斷這個分頁有沒有被改過。"""
+  raw = json.dumps(values,
+                   ensure_ascii=False,
+                   separators=(',', ':'),
+                   default=str)
+  return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def fetch_snapshot(previous=None) -> Snapshot:
+  """
+    從資料來源（backend）載入快照並整理成欄式資料：
+    - 變更標記（Google 為 modifiedTime）沒變：直接沿用上一份快照
+    - 有變：讀回所有分頁，只重建內容雜湊不同的分頁與其索引，
+      其餘分頁沿用舊的 SheetTable；內容完全沒變時版本號不變
+    - 上一份是冷啟動用的快照檔（bridge）：標記沒變也整份讀回建記憶體索引，
+      內容相同就沿用版本號，ETag 與各種快取都不受影響
+    """
+  with timed('load_modified'):
+    modified = backend.modified()
+  if (previous is not None and modified and modified == previous.modified and
+      not previous.bridge):
+    previous.checked_at = time.time()
+    return previous
+  with timed('load_fetch'):
+    sheets = backend.sheets()
+
+  # 只沿用記憶體裡的分頁；從快照檔開的分頁有變就整份改用記憶體索引
+  previous_tables = {t.title: t for t in (previous.tables if previous else ())}
+  reusable = {
+      title: t
+      for title, t in previous_tables.items()
+      if isinstance(t, SheetTable)
+  }
+  # 個別分頁讀取失敗：沿用上一版的同名分頁（沒有就先略過），並記在 errors
+  errors, tables = {}, []
+  with timed('load_build'):
+    for entry in sheets:
+      if isinstance(entry, SheetFetchError):
+        print("[snapshot] sheet fetch failed:", entry)
+        errors[entry.title] = repr(entry.error)
+        if entry.title in previous_tables:
+          tables.append(previous_tables[entry.title])
+        continue
+      title, header, rows = entry
+      digest = values_digest([header, *rows])
+      table = reusable.get(title)
+      if table is None or table.digest != digest:
+        table = SheetTable(title, header, rows, digest=digest)
+      tables.append(table)
+
+  if sheets and len(errors) == len(sheets):
+    raise sheets[0].error
+  # 有分頁沒讀到時不記變更標記，下次更新會整份重讀
+  if errors:
+    modified = None
+
+  # 每個分頁都沿用舊表（SheetTable 以物件相等比較）：內容沒變
+  if previous is not None and tables == previous.tables:
+    previous.modified = modified
+    previous.errors = errors
+    previous.checked_at = time.time()
+    return previous
+  version = previous.version + 1 if previous is not None else 1
+  snap = Snapshot(version, tables, modified, errors)
+  if previous is not None and snap.digest == previous.digest:
+    # 內容與上一版相同（由快照檔換成記憶體索引）：沿用版本號
+    snap.version = previous.version
+  else:
+    metrics.incr('snapshot.new_version')
+  return snap
+
+
+def load_snapshot(previous=None) -> Snapshot:
+  """
+    單一 process 的 loader：
+    - 第一次載入（新 instance）：有本機快照檔就直接開檔先回應，
+      SnapshotStore 隨即在背景向資料來源確認並改建記憶體索引
+    - 之後由 fetch_snapshot 向資料來源確認，產生新版本後在背景寫回快照檔
+    """
+  if previous is None:
+    stored = open_stored_snapshot()
+    if stored is not None:
+      stored.bridge = True
+      return stored
+  snap = fetch_snapshot(previous)
+  if previous is None or snap.version != previous.version:
+    threading.Thread(target=save_snapshot, args=(snap,), daemon=True).start()
+  return snap
+
+
+# ====== 多個 worker 共用快照檔 ======
+# SHARED_SNAPSHOT=1：同一台機器上只有一個 process 向資料來源更新並寫快照檔，
+# 其他 worker 只在檔案被換掉時重新開檔；大家都透過 mmap 讀同一個檔，
+# 資料只在 OS page cache 裡存一份，worker 變多記憶體也不會跟著倍增
+SHARED_SNAPSHOT = os.getenv("SHARED_SNAPSHOT", "0") == "1"
+# 還沒有快照檔時，非更新者最多等幾秒讓更新者寫好
+SHARED_WAIT = int(os.getenv("SHARED_WAIT", "60"))
+
+
+class RefresherLock:
+  """
+    以 fcntl 檔案鎖決定誰負責更新：第一個拿到鎖的 process 之後一直持有，
+    process 結束時鎖自動釋放，其他 worker 下次更新時就會接手。
+    沒有 fcntl 的平台（Windows）每個 process 都當自己是更新者。
+    """
+
+  def __init__(self, path):
+    self._path = path
+    self._lock = threading.Lock()
+    self._fd = None
+
+  @property
+  def held(self) -> bool:
+    return self._fd is not None
+
+  def acquire(self) -> bool:
+    if self._fd is not None or fcntl is None:
+      return True
+    with self._lock:
+      if self._fd is not None:
+        return True
+      fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+      try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError:
+        os.close(fd)
+        return False
+      self._fd = fd
+      print(f"[snapshot] pid {os.getpid()} is the snapshot refresher")
+      return True
+
+
+refresher_lock = RefresherLock(SNAPSHOT_DB + '.lock')
+
+
+def wait_for_stored_snapshot(timeout):
+  deadline = time.time() + timeout
+  while True:
+    snap = open_stored_snapshot()
+    if snap is not None or time.time() >= deadline:
+      return snap
+    time.sleep(0.5)
+
+
+def load_shared_snapshot(previous=None) -> Snapshot:
+  """
+    SHARED_SNAPSHOT 模式的 loader：
+    - 更新者：照常向資料來源確認，有新版本就同步寫檔（暫存檔 + os.replace），
+      再改用剛寫好的檔案回應，記憶體裡的整理結果用完即丟
+    - 其他 worker：只比對快照檔的 inode / mtime，檔案換了才重新開檔
+    """
+  if refresher_lock.acquire():
+    if previous is None:
+      previous = open_stored_snapshot()
+    snap = fetch_snapshot(previous)
+    if snap is previous:
+      return snap
+    save_snapshot(snap)
+    return open_stored_snapshot() or snap
+
+  if previous is not None:
+    if file_identity(SNAPSHOT_DB) == getattr(previous, 'file_id', None):
+      previous.checked_at = time.time()
+      return previous
+    return open_stored_snapshot() or previous
+  snap = wait_for_stored_snapshot(SHARED_WAIT)
+  if snap is None:
+    raise RuntimeError("快照檔尚未產生（等待負責更新的 worker）")
+  return snap
+
+
+# ====== 讀取協調：同時只讀一次、遇到配額 / 5xx 退避重試 ======
+# 單次載入最多重試幾次；退避秒數 = random(0, min(上限, 基數 × 2^次數))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "4"))
+FETCH_BACKOFF_BASE = float(os.getenv("FETCH_BACKOFF_BASE", "1.0"))
+FETCH_BACKOFF_MAX = float(os.getenv("FETCH_BACKOFF_MAX", "32"))
+
+
+def is_retryable(e) -> bool:
+  """429（配額）、5xx 與連線錯誤才值得重試；401 / 403 / 404 重試也沒用。"""
+  if isinstance(e, gspread.exceptions.APIError):
+    status = e.response.status_code
+    return status == 429 or status >= 500
+  # 只認網路層的暫時錯誤；Folder / Parquet 的 FileNotFoundError、PermissionError
+  # 雖然也是 OSError，重試只會白等
+  return isinstance(e, (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout, ConnectionError,
+                        TimeoutError))
+
+
+def backoff_delay(attempt) -> float:
+  """指數退避 + full jitter，避免多個 instance 同時重試。"""
+  ceiling = min(FETCH_BACKOFF_MAX, FETCH_BACKOFF_BASE * (2**attempt))
+  return random.uniform(0, ceiling)
+
+
+def with_backoff(fn):
+  attempt = 0
+  while True:
+    try:
+      return fn()
+    except Exception as e:
+      if attempt >= FETCH_RETRIES or not is_retryable(e):
+        raise
+      delay = backoff_delay(attempt)
+      attempt += 1
+      metrics.incr('fetch.retry')
+      print(f"[snapshot] fetch failed ({e!r}); "
+            f"retry {attempt}/{FETCH_RETRIES} in {delay:.1f}s")
+      time.sleep(delay)
+
+
+class SingleFlight:
+  """同一時間只執行一次 fn；執行期間其他呼叫者等待並共用同一個結果（或例外）。"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._future = None
+
+  def do(self, fn):
+    with self._lock:
+      future = self._future
+      leader = future is None
+      if leader:
+        future = self._future = Future()
+    if not leader:
+      return future.result()
+    try:
+      future.set_result(fn())
+    except BaseException as e:
+      future.set_exception(e)
+    finally:
+      with self._lock:
+        self._future = None
+    return future.result()
+
+
+class SnapshotStore:
+  """
+    保存目前的快照並負責更新：
+    - 第一次取用時同步載入（之後的請求都直接讀記憶體）
+    - 同時有多個請求需要載入時只讀一次 Google，大家共用結果
+    - 過期時在背景執行緒更新，退避重試期間繼續用舊快照回應
+    - 整輪重試都失敗後冷卻一段時間，不讓每個請求都再打一次 API
+    - 另有一條常駐執行緒每 ttl 秒主動更新，讓資料保持新鮮
+    """
+
+  def __init__(self, loader, ttl):
+    self._loader = loader
+    self._ttl = ttl
+    self._lock = threading.Lock()
+    self._flight = SingleFlight()
+    self._snapshot = None
+    self._refreshing = False
+    self._ticker = None
+    self._failures = 0
+    self._retry_at = 0.0
+    self.last_error = None
+
+  def get(self) -> Snapshot:
+    snap = self._snapshot
+    if snap is None:
+      if time.time() < self._retry_at:
+        raise RuntimeError(f"資料來源暫時無法讀取，稍後重試：{self.last_error}")
+      snap = self.refresh()
+      self._start_ticker()
+    stale = self._ttl > 0 and snap.age() > self._ttl
+    # 快照檔只是冷啟動的橋：開好之後馬上在背景改建記憶體索引
+    if (stale or snap.bridge) and time.time() >= self._retry_at:
+      self.refresh_async()
+    return snap
+
+  def refresh(self) -> Snapshot:
+    return self._flight.do(self._load)
+
+  @property
+  def failures(self) -> int:
+    return self._failures
+
+  def retry_in(self) -> float:
+    return round(max(0.0, self._retry_at - time.time()), 1)
+
+  def refresh_async(self):
+    with self._lock:
+      if self._refreshing:
+        return
+      self._refreshing = True
+    threading.Thread(target=self._refresh_quietly, daemon=True).start()
+
+  def _load(self) -> Snapshot:
+    try:
+      # loader 拿到目前快照，沒變就原樣回傳，有變才給新版本
+      snap = with_backoff(lambda: self._loader(self._snapshot))
+      if snap is not self._snapshot:
+        # 前綴建議索引在換上新快照前建好，/api/suggest 不必等
+        with timed('suggest_build'):
+          snap.suggestions()
+    except Exception as e:
+      metrics.incr('snapshot.load_failed')
+      self._failures += 1
+      self._retry_at = time.time() + backoff_delay(self._failures)
+      self.last_error = repr(e)
+      raise
+    self._snapshot = snap
+    self._failures = 0
+    self._retry_at = 0.0
+    self.last_error = None
+    return snap
+
+  def _refresh_quietly(self):
+    try:
+      self.refresh()
+    except Exception as e:
+      print("[snapshot] refresh failed:", repr(e))
+      traceback.print_exc()
+    finally:
+      self._refreshing = False
+
+  def _start_ticker(self):
+    if self._ticker is not None or self._ttl <= 0:
+      return
+    with self._lock:
+      if self._ticker is not None:
+        return
+      self._ticker = threading.Thread(target=self._tick, daemon=True)
+    self._ticker.start()
+
+  def _tick(self):
+    while True:
+      time.sleep(self._ttl)
+      self._refresh_quietly()
+
+
+if SHARED_SNAPSHOT and not SNAPSHOT_DB:
+  print("[snapshot] SHARED_SNAPSHOT 需要 SNAPSHOT_DB，改用單一 process 模式")
+  SHARED_SNAPSHOT = False
+snapshots = SnapshotStore(
+    load_shared_snapshot if SHARED_SNAPSHOT else load_snapshot, SNAPSHOT_TTL)
+
+
+# ====== 查詢結果快取 ======
+# 最多保留幾組關鍵字的查詢結果
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+
+
+class QueryCache:
+  """
+    以 (keyword, 快照版本) 為 key 的 LRU 快取；換成較新的版本時整個清空，
+    換版瞬間還拿著舊快照的請求照算但不放進快取，也不會清掉新版本的結果。
+    同一個類別按鈕 / 公司名稱重複點擊時，直接回傳上次算好的結果。
+    """
+
+  def __init__(self, maxsize):
+    self._maxsize = maxsize
+    self._lock = threading.Lock()
+    self._data = OrderedDict()
+    self._version = None
+    self.hits = 0
+    self.misses = 0
+
+  def get_or_compute(self, keyword, version, compute):
+    key = (keyword, version)
+    with self._lock:
+      if self._version is None or version > self._version:
+        self._data.clear()
+        self._version = version
+      if key in self._data:
+        self._data.move_to_end(key)
+        self.hits += 1
+        return self._data[key]
+      self.misses += 1
+    value = compute()
+    with self._lock:
+      if version == self._version and self._maxsize > 0:
+        self._data[key] = value
+        while len(self._data) > self._maxsize:
+          self._data.popitem(last=False)
+    return value
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+          "size": len(self._data),
+          "maxsize": self._maxsize,
+          "hits": self.hits,
+          "misses": self.misses,
+          "hit_rate": (round(self.hits / (self.hits + self.misses), 3)
+                       if self.hits + self.misses else None),
+          "version": self._version,
+      }
+
+
+query_cache = QueryCache(QUERY_CACHE_SIZE)
+
+
 # ====== 資料讀取 ======
+# 每頁筆數（網頁與 JSON API 預設值）；API 可用 page_size 指定，上限 MAX_PAGE_SIZE
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+# 串流模式（STREAM_RESULTS=1 或網址加 ?stream=1）：不分頁，結果列邊查邊送
+STREAM_RESULTS = os.getenv("STREAM_RESULTS", "0")
+# 串流時累積多少段模板輸出才送出一次
+STREAM_BUFFER = int(os.getenv("STREAM_BUFFER", "200"))
+
+
 def get_all_types():
   """蒐集所有工作表裡的 Type（去重，依出現順序）。"""
-  types, seen = [], set()
-  ss = gclient().open_by_key(SPREADSHEET_ID)
-  for sheet in ss.worksheets():
-    data = sheet.get_all_records()
-    for row in data:
-      for k in row.keys():
-        if is_type_col(k):
-          tv = clean_cell(row[k])
-          if tv and tv not in seen:
-            seen.add(tv)
-            types.append(tv)
-          break
-  return types
-
-
-def get_results(keyword, categories):
+  return list(snapshots.get().types)
+
+
+# 查詢語法的欄位名稱 → 比對的欄位
+QUERY_FIELDS = {'company': 'Company', 'type': 'Type', 'sheet': SOURCE_COL}
+_QUERY_TOKEN = re.compile(r'(-?)(?:([A-Za-z]+):)?(?:"([^"]*)"?|(\S+))')
+
+
+class Query:
   """
-    跨所有分頁搜尋；只保留 Title & Video url 皆有值的列。
-    關鍵字同時比對 Company、Title、以及其他欄位（不分大小寫）。
+    搜尋框的查詢語法，解析一次、對快照做集合運算：
+      蘋果 開箱          兩個詞都要符合（AND，也可寫 AND）
+      蘋果 OR Apple      任一符合（OR 或 |，比 AND 優先結合）
+      -開箱              排除
+      "Uber Eats"        含空白的片語
+      company:蘋果 type:美妝 sheet:2024   只比對該欄（值包含即可，可加引號）
+    每個詞都是不分大小寫的子字串比對；不是欄位名稱的「xxx:」當一般文字（例如網址）。
+    整串都沒有可用的詞時（例如只有 OR），整串當一般文字比對。
     """
-  ss = gclient().open_by_key(SPREADSHEET_ID)
-  results, all_fields = [], []
-  keyword_for_cat = (keyword or '').strip()
-  is_cat = keyword_for_cat in categories
-  kw_lower = keyword_for_cat.lower()
-
-  for sheet in ss.worksheets():
-    data = sheet.get_all_records()
-    for row in data:
-      # 全空列跳過
-      if all(not clean_cell(v) for v in row.values()):
+
+  def __init__(self, text):
+    self.text = text
+    # clauses 之間是 AND、clause 裡的詞之間是 OR；詞為 (field, needle, negate)
+    self.clauses = []
+    join_or = False
+    for m in _QUERY_TOKEN.finditer(text):
+      neg, field, quoted, bare = m.groups()
+      if not neg and field is None and quoted is None:
+        if bare in ('OR', '|'):
+          join_or = bool(self.clauses)
+          continue
+        if bare == 'AND':
+          continue
+      if field is not None and field.lower() not in QUERY_FIELDS:
+        field, quoted, bare = None, None, m.group(0)[len(neg):]
+      needle = (bare if quoted is None else quoted).lower()
+      if not needle:
         continue
+      term = (QUERY_FIELDS[field.lower()] if field else None, needle, bool(neg))
+      if join_or:
+        self.clauses[-1].append(term)
+      else:
+        self.clauses.append([term])
+      join_or = False
+    if not self.clauses and text.strip():
+      # 整串都不成詞（例如只有 OR、|、AND 或一個 "）：照舊整串當子字串比對
+      self.clauses = [[(None, text.strip().lower(), False)]]
+
+  @staticmethod
+  def term_ids(snap, field, needle):
+    if field is None:
+      return snap.search(needle)
+    if field == SOURCE_COL:
+      return snap.sheet_ids(needle)
+    return snap.value_ids(field, needle)
 
-      # 先清一份 row
-      row_cp = {k: clean_cell(v) for k, v in row.items()}
+  def terms(self) -> list:
+    """相關度計分用的詞：不限欄位、不是排除的詞（去重）。"""
+    return list(
+        dict.fromkeys(needle for clause in self.clauses
+                      for field, needle, negate in clause
+                      if field is None and not negate))
 
-      # 必須有 Title 與 Video url
-      title_val = row_cp.get('Title', '')
-      url_val = row_cp.get('Video url', '')
-      if not title_val or not url_val:
+  def match(self, snap) -> set:
+    """回傳符合的全域列編號；交集從最小的集合開始，排除的詞最後一次扣掉。"""
+    included, excluded = [], set()
+    everything = None
+    for clause in self.clauses:
+      if len(clause) == 1 and clause[0][2]:
+        excluded.update(self.term_ids(snap, *clause[0][:2]))
         continue
+      ids = set()
+      for field, needle, negate in clause:
+        found = self.term_ids(snap, field, needle)
+        if negate:
+          if everything is None:
+            everything = set(range(snap.size))
+          ids |= everything.difference(found)
+        else:
+          ids.update(found)
+      included.append(ids)
+    if included:
+      included.sort(key=len)
+      ids = included[0].intersection(*included[1:])
+    elif excluded:
+      # 只有排除的詞：從全部列扣掉
+      ids = set(range(snap.size))
+    else:
+      return set()
+    return ids - excluded
+
+
+def find_ids(keyword, categories, snap):
+  """
+    依查詢語法（見 Query）比對 Company、Title、以及其他欄位（不分大小寫），
+    整串關鍵字剛好是某個 Type 時再加上該類別的列（類別按鈕）；回傳遞增的全域列編號。
+    """
+  keyword_for_cat = (keyword or '').strip()
+
+  # 關鍵字比對（公司 / 標題 / 任一欄位，或指定欄位）
+  ids = Query(keyword_for_cat).match(snap)
+
+  # 類別比對（Type 完全相同）
+  if keyword_for_cat in categories:
+    ids.update(snap.type_ids(keyword_for_cat))
+  return sorted(ids)
+
+
+def split_by_table(snap, ids):
+  """依工作表切出各自的 (base, table, 列編號)（ids 已排序，用 bisect 切段）。"""
+  for base, table in zip(snap.bases, snap.tables):
+    lo = bisect.bisect_left(ids, base)
+    hi = bisect.bisect_left(ids, base + table.size)
+    if lo < hi:
+      yield base, table, [gid - base for gid in ids[lo:hi]]
+
+
+class ResultSet:
+  """
+    一次查詢的結果：只保存全域列編號（遞增，存成 array 放進查詢快取）、欄位聯集與公司清單，
+    總筆數不必組出任何一列；要顯示時才把那一頁組成 Row。
+    """
+
+  def __init__(self, snap, ids):
+    self.snap = snap
+    self.ids = array('I', ids)
+    fields = {}  # 當有序集合用
+    self.company_counts = {}  # 依出現順序
+    for _, table, row_ids in self._by_table():
+      fields.update(dict.fromkeys(table.fields))
+      # 快照檔：只讀這些列的 company 欄（每批一次查詢），不掃整段
+      for c in table.values('Company', row_ids):
+        if c:
+          self.company_counts[c] = self.company_counts.get(c, 0) + 1
+    self.all_fields = list(fields)
+    self.companies = list(self.company_counts)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def _by_table(self):
+    return split_by_table(self.snap, self.ids)
+
+  def where(self, field, value) -> 'ResultSet':
+    """只留下 field 欄等於 value 的列；Type / Company 直接查索引。"""
+    snap = self.snap
+    if value and field in ('Type', 'Company'):
+      if field == 'Type':
+        wanted = set(snap.type_ids(value))
+      else:
+        wanted = set(snap.company_ids(value))
+      return ResultSet(snap, [gid for gid in self.ids if gid in wanted])
+    kept = []
+    for gid in self.ids:
+      table, row_id = snap.locate(gid)
+      if table.get(row_id, field) == value:
+        kept.append(gid)
+    return ResultSet(snap, kept)
+
+  def rows(self, start=0, stop=None) -> list:
+    return [self.snap.row(gid) for gid in self.ids[start:stop]]
+
+  def iter_rows(self):
+    """逐列產生 dict（串流輸出用，不會一次組出整份結果）。"""
+    for gid in self.ids:
+      yield self.snap.row(gid)
+
+
+def get_results(keyword, categories, snap=None):
+  """
+    跨所有分頁搜尋；只保留 Title & Video url 皆有值的列。
+    關鍵字同時比對 Company、Title、以及其他欄位（不分大小寫），
+    透過快照的 n-gram 索引查詢，不再逐格掃描。
+    """
+  snap = snap or snapshots.get()
+  result_set = ResultSet(snap, find_ids(keyword, categories, snap))
+  return result_set.rows(), result_set.all_fields
+
+
+def search(keyword, categories, snap=None) -> ResultSet:
+  """
+    回傳 ResultSet（列編號、all_fields、companies），依 (keyword, 快照版本) 快取。
+    回傳的物件會被多個請求共用，呼叫端不要就地修改。
+    """
+  snap = snap or snapshots.get()
+  return query_cache.get_or_compute(
+      keyword, snap.version,
+      lambda: ResultSet(snap, find_ids(keyword, categories, snap)))
+
+
+# ====== 相關度排序（sort=relevance） ======
+# 預設排序：sheet = 依工作表順序（可分頁）、relevance = 只取相關度最高的一頁
+DEFAULT_SORT = os.getenv("DEFAULT_SORT", "sheet")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Title / Company 的 BM25 權重；其他欄位的命中只在這兩欄同分時才比
+RANK_WEIGHTS = {'Title': 3.0, 'Company': 2.0}
 
-      # 合併 Type 欄，統一為 'Type'
-      type_val = None
-      for k in list(row_cp.keys()):
-        if is_type_col(k):
-          type_val = row_cp[k]
-          break
-      if type_val is not None:
-        row_cp['Type'] = type_val
-
-      # Company 欄（Company/品牌/公司/brand）
-      company_val = ''
-      for k in list(row_cp.keys()):
-        if is_company_col(k):
-          company_val = row_cp[k]
-          break
-      row_cp['Company'] = company_val
-
-      # 來源工作表
-      row_cp['來源工作表'] = clean_cell(sheet.title)
-
-      # 比對條件
-      match_cat = (is_cat and type_val == keyword_for_cat)
-
-      # 關鍵字比對（公司 / 標題 / 任一欄位）
-      if kw_lower:
-        company_lower = company_val.lower()
-        title_lower = title_val.lower()
-        any_field_match = any(kw_lower in str(v).lower()
-                              for v in row_cp.values())
-        match_kw = (kw_lower in company_lower) or \
-                   (kw_lower in title_lower) or any_field_match
+
+def bm25(tf, length, avg_length):
+  norm = 1 - BM25_B + BM25_B * length / avg_length if avg_length else 1
+  return tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+
+def rank_ids(result_set, query, k, complete=False) -> list:
+  """
+    依相關度取前 k 名的全域列編號（高分在前，同分依工作表順序）。排序鍵依序為：
+    Title / Company 完全等於關鍵字的詞數 → 含有關鍵字的詞數 → 這兩欄的 BM25 → 其他欄位的 BM25。
+    第一輪只看 Title / Company：Company 的值不多，每個值比對、計分一次；Title 整欄逐詞比對。
+    依前兩項把列分層，由高往低取層、湊滿 k 列就停，更低層的列都不算分數；
+    有 k 列命中 Title / Company 時，只在其他欄位命中的列完全不必看。
+    算好的列用 heap 取出第 k 名的門檻，只有不低於門檻的列才讀其他欄位算最後一項。
+    complete：result_set 就是 query 的完整比對結果（沒有篩選、沒有類別按鈕加入的列）。
+    """
+  snap = result_set.snap
+  terms = query.terms()
+  if not terms:
+    return result_set.ids[:k]
+  size = max(snap.size, 1)
+  idf = []
+  for t in terms:
+    if complete and query.clauses == [[(None, t, False)]]:
+      # 單一詞的查詢：結果筆數就是 df，不必再搜尋一次
+      df = len(result_set)
+    else:
+      df = len(snap.search(t))
+    idf.append(math.log(1 + (size - df + 0.5) / (df + 0.5)))
+  title_weight, title_avg = RANK_WEIGHTS['Title'], snap.avg_length('Title')
+  company_weight = RANK_WEIGHTS['Company']
+  company_avg = snap.avg_length('Company')
+
+  # Company 值 → (完全相等的詞, 包含的詞, 分數)；詞以位元表示
+  companies = {}
+
+  def judge_company(value):
+    lower = value.lower()
+    exact = hit = 0
+    score = 0.0
+    for bit, t in enumerate(terms):
+      tf = lower.count(t)
+      if tf:
+        hit |= 1 << bit
+        if lower == t:
+          exact |= 1 << bit
+        score += idf[bit] * company_weight * bm25(tf, len(lower), company_avg)
+    companies[value] = (exact, hit, score)
+
+  tiers = {}  # (完全相等的詞數, 包含的詞數) → [(gid, 小寫 Title, Company)]
+  misses = []  # (base, 列編號)：Title / Company 都沒命中，不到 k 列有命中才用得到
+  for base, table, row_ids in result_set._by_table():
+    titles, names = table.values_of(('Title', 'Company'), row_ids)
+    titles = [v.lower() for v in titles]
+    for v in set(names).difference(companies):
+      judge_company(v)
+    exact = [companies[v][0] for v in names]
+    hit = [companies[v][1] for v in names]
+    for bit, t in enumerate(terms):
+      for i in [i for i, v in enumerate(titles) if t in v]:
+        hit[i] |= 1 << bit
+        if titles[i] == t:
+          exact[i] |= 1 << bit
+    for i, row_id in enumerate(row_ids):
+      if hit[i]:
+        tier = (exact[i].bit_count(), hit[i].bit_count())
+        tiers.setdefault(tier, []).append((base + row_id, titles[i], names[i]))
       else:
-        match_kw = False
+        misses.append((base, row_id))
+
+  keys = []  # ((完全相等, 命中, 分數), -gid)
+  for tier in sorted(tiers, reverse=True):
+    for gid, title, company in tiers[tier]:
+      score = companies[company][2]
+      for bit, t in enumerate(terms):
+        tf = title.count(t)
+        if tf:
+          score += idf[bit] * title_weight * bm25(tf, len(title), title_avg)
+      keys.append(((*tier, score), -gid))
+    if len(keys) >= k:
+      break
+  else:
+    keys.extend(((0, 0, 0.0), -(base + row_id)) for base, row_id in misses)
+
+  top = heapq.nlargest(k, keys)
+  if not top:
+    return []
+  # 與第 k 名前三項同分的列也要算最後一項，才分得出先後
+  threshold = top[-1][0]
+  tied = {-neg: key for key, neg in keys if key >= threshold}
+  ranked = []
+  for base, table, row_ids in split_by_table(snap, sorted(tied)):
+    # 同分的列一次讀出其他各欄（快照檔只查這些列）
+    others = table.values_of(
+        [field for field in table.fields if field not in RANK_WEIGHTS], row_ids)
+    other = [0.0] * len(row_ids)
+    for col in others:
+      col = [v.lower() for v in col]
+      for bit, t in enumerate(terms):
+        for i, tf in enumerate([v.count(t) for v in col]):
+          if tf:
+            other[i] += idf[bit] * bm25(tf, 0, 0)
+    for row_id, score in zip(row_ids, other):
+      ranked.append(((*tied[base + row_id], score), -(base + row_id)))
+  return [-neg for _, neg in heapq.nlargest(k, ranked)]
+
+
+def ranked_rows(result_set, keyword, k, filters=()) -> list:
+  """
+    sort=relevance：相關度最高的 k 列（dict）。
+    排名依 (關鍵字, 篩選條件, k, 快照版本) 放進查詢快取，換頁 / 重新整理不必再算。
+    """
+  snap = result_set.snap
+  # 沒有篩選、也不是類別按鈕時，result_set 就是關鍵字的完整比對結果
+  complete = not any(filters) and keyword.strip() not in snap.types
+  ids = query_cache.get_or_compute(
+      ('rank', keyword, filters, k), snap.version,
+      lambda: rank_ids(result_set, Query(keyword), k, complete))
+  return [snap.row(gid) for gid in ids]
+
+
+_CURSOR_DIGEST = 16  # cursor 裡帶的快照內容雜湊長度（hex 字元）
+
+
+def encode_cursor(direction, gid, digest) -> str:
+  """
+    分頁 cursor：'a' = 這筆之後、'b' = 這筆之前（keyset，不受頁碼位移影響）。
+    全域列編號只是位置，資料一改就會位移，所以一併帶上快照的內容雜湊。
+    """
+  raw = f"{direction}{digest[:_CURSOR_DIGEST]}{gid}".encode('ascii')
+  return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+  """回傳 (direction, digest, gid)；格式不對就當作第一頁。"""
+  try:
+    raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    raw = raw.decode('ascii')
+    if raw[:1] in ('a', 'b'):
+      digest = raw[1:1 + _CURSOR_DIGEST]
+      return raw[0], digest, int(raw[1 + _CURSOR_DIGEST:])
+  except (ValueError, UnicodeDecodeError):
+    pass
+  return None, None, None
+
+
+def paginate(result_set, cursor, page_size):
+  """
+    依 cursor 取出一頁，回傳 (rows, start, next_cursor, prev_cursor)。
+    start 是這頁第一筆在整個結果中的位置（從 0 起算）。
+    cursor 是舊版資料產生的（內容雜湊不同）就從第一頁開始，不回傳位移過的頁面。
+    """
+  ids = result_set.ids
+  digest = result_set.snap.digest
+  direction, cursor_digest, gid = decode_cursor(cursor or '')
+  if cursor_digest != digest[:_CURSOR_DIGEST]:
+    direction = None
+  if direction == 'a':
+    start = bisect.bisect_right(ids, gid)
+  elif direction == 'b':
+    start = max(0, bisect.bisect_left(ids, gid) - page_size)
+  else:
+    start = 0
+  start = min(start, len(ids))
+  stop = min(len(ids), start + page_size)
+  next_cursor = (encode_cursor('a', ids[stop - 1], digest)
+                 if stop < len(ids) else None)
+  if 0 < start < len(ids):
+    prev_cursor = encode_cursor('b', ids[start], digest)
+  elif start > 0:
+    # cursor 已超過結尾（手改的 cursor）：上一頁指向最後一頁
+    prev_cursor = encode_cursor('b', ids[-1] + 1, digest)
+  else:
+    prev_cursor = None
+  return result_set.rows(start, stop), start, next_cursor, prev_cursor
 
-      if match_cat or match_kw:
-        # 移除其餘 Type 原欄名鍵，只保留 'Type'
-        for delk in list(row_cp.keys()):
-          if is_type_col(delk) and delk != 'Type':
-            row_cp.pop(delk, None)
 
-        results.append(row_cp)
-        for k in row_cp.keys():
-          if k not in all_fields:
-            all_fields.append(k)
+# 欄位順序：Type → Company → Title → Video url → 分類 → 來源工作表 → 其他
+def pick_columns(cols):
+  order, added = [], set()
 
-  return results, all_fields
+  def add(name):
+    if name in cols and name not in added:
+      order.append(name)
+      added.add(name)
+
+  add('Type')
+  add('Company')
+  add('Title')
+  add('Video url')
+  add('分類')
+  add('來源工作表')
+  for c in cols:
+    if c not in added and not is_type_col(c):
+      order.append(c)
+      added.add(c)
+  return order
+
+
+def result_payload(results, columns):
+  """給前端篩選 / 排序用的精簡 JSON：欄名只出現一次，每列是字串陣列。"""
+  return {
+      "columns": columns,
+      "company": columns.index('Company') if 'Company' in columns else -1,
+      "rows": [[r.get(c, '') for c in columns] for r in results],
+  }
 
 
 # ====== 偵錯（保留，避免 endpoint 名稱衝突） ======
@@ -180,24 +2059,186 @@ def debug_page():
   if not DEBUG_KEY or key != DEBUG_KEY:
     return "forbidden", 403
   try:
-    ss = gclient().open_by_key(SPREADSHEET_ID)
+    snap = snapshots.get()
     info = []
-    for sh in ss.worksheets():
-      rows = sh.get_all_records()
-      cols = set()
-      for r in rows:
-        cols.update(r.keys())
+    for t in snap.tables:
       info.append({
-          "sheet": sh.title,
-          "rows": len(rows),
-          "columns": sorted(list(cols))
+          "sheet": t.title,
+          "rows": t.record_count,
+          "searchable_rows": t.size,
+          "columns": sorted(t.header) if t.record_count else []
       })
-    return {"worksheets": info}
+    return {
+        "source": backend.key,
+        "snapshot": {
+            "version": snap.version,
+            "modified": snap.modified,
+            "age_seconds": round(snap.age(), 1),
+            "ttl_seconds": SNAPSHOT_TTL,
+            "stored_file": getattr(snap, 'path', None),
+            "shared": SHARED_SNAPSHOT,
+            "refresher": refresher_lock.held,
+            "sheet_errors": snap.errors,
+            "last_refresh_error": snapshots.last_error,
+            "consecutive_failures": snapshots.failures,
+            "retry_in_seconds": snapshots.retry_in(),
+        },
+        "query_cache": query_cache.stats(),
+        "worksheets": info
+    }
   except Exception as e:
     traceback.print_exc()
     return {"error": repr(e)}, 500
 
 
+@app.route('/__metrics', methods=['GET'], endpoint='__metrics_page')
+def metrics_page():
+  """各階段耗時百分位數、快取命中率與上游呼叫次數（需 DEBUG_KEY）。"""
+  key = request.args.get('key', '')
+  if not DEBUG_KEY or key != DEBUG_KEY:
+    return "forbidden", 403
+  return {
+      **metrics.stats(),
+      "query_cache": query_cache.stats(),
+      "fragment_cache": fragment_cache.stats(),
+  }
+
+
+# ====== JSON API（與網頁共用同一個搜尋核心） ======
+def snapshot_etag(snap, *parts) -> str:
+  """
+    強 ETag：由快照內容雜湊與查詢參數組成，資料沒變就不變（跨 instance 一致）。
+    回應內容只能放由這些值決定的東西（例如 digest，不能放各 instance 不同的 version）。
+    """
+  raw = '\x1f'.join([snap.digest] + [str(p) for p in parts])
+  return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def conditional_json(etag, build):
+  """If-None-Match 命中就回 304（不必計算內容），否則回 JSON 並附 ETag。"""
+  if request.if_none_match.contains_weak(etag):
+    resp = Response(status=304)
+  else:
+    resp = jsonify(build())
+  resp.set_etag(etag)
+  resp.headers['Cache-Control'] = 'no-cache'
+  return resp
+
+
+@app.route('/api/categories', methods=['GET'])
+def api_categories():
+  try:
+    with timed('snapshot'):
+      snap = snapshots.get()
+  except Exception as e:
+    traceback.print_exc()
+    return {"error": f"讀取 Google 試算表失敗：{e}"}, 503
+  return conditional_json(snapshot_etag(snap, 'categories'), lambda: {
+      "digest": snap.digest,
+      "categories": list(snap.types),
+      "counts": snap.facets()["types"],
+      "companies": snap.facets()["companies"],
+      "type_company": snap.facets()["type_company"],
+  })
+
+
+@app.route('/api/suggest', methods=['GET'])
+def api_suggest():
+  q = normalize_prefix(request.args.get('q', ''))
+  try:
+    limit = int(request.args.get('limit', SUGGEST_LIMIT))
+  except ValueError:
+    limit = SUGGEST_LIMIT
+  limit = min(max(limit, 1), SUGGEST_MAX)
+  try:
+    with timed('snapshot'):
+      snap = snapshots.get()
+  except Exception as e:
+    traceback.print_exc()
+    return {"error": f"讀取 Google 試算表失敗：{e}"}, 503
+
+  def build():
+    with timed('suggest'):
+      found = snap.suggestions().suggest(q, limit)
+    return {
+        "digest": snap.digest,
+        "q": q,
+        "suggestions": [{
+            "value": value,
+            "kind": kind,
+            "count": n
+        } for kind, value, n in found],
+    }
+
+  etag = snapshot_etag(snap, 'suggest', q, limit)
+  return conditional_json(etag, build)
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+  keyword = request.args.get('keyword', '').strip()
+  company = request.args.get('company', '').strip()
+  type_filter = request.args.get('type', '').strip()
+  cursor = request.args.get('cursor', '')
+  sort = request.args.get('sort', DEFAULT_SORT)
+  try:
+    page_size = int(request.args.get('page_size', PAGE_SIZE))
+  except ValueError:
+    page_size = PAGE_SIZE
+  page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+  try:
+    with timed('snapshot'):
+      snap = snapshots.get()
+  except Exception as e:
+    traceback.print_exc()
+    return {"error": f"讀取 Google 試算表失敗：{e}"}, 503
+
+  def build():
+    # 沒有關鍵字時，type 就當類別按鈕查詢
+    query = keyword or type_filter
+    with timed('search'):
+      if query:
+        result_set = search(query, snap.types, snap)
+      else:
+        result_set = ResultSet(snap, [])
+    columns = pick_columns(result_set.all_fields)
+    companies = result_set.companies
+    company_counts = result_set.company_counts
+    with timed('rows'):
+      if company:
+        result_set = result_set.where('Company', company)
+      if type_filter:
+        result_set = result_set.where('Type', type_filter)
+      if sort == 'relevance':
+        # 只回傳相關度最高的一頁，不分頁
+        rows = ranked_rows(result_set, query, page_size,
+                           (company, type_filter))
+        start, next_cursor, prev_cursor = 0, None, None
+      else:
+        rows, start, next_cursor, prev_cursor = paginate(
+            result_set, cursor, page_size)
+    return {
+        "digest": snap.digest,
+        "keyword": keyword,
+        "company": company,
+        "type": type_filter,
+        "sort": sort,
+        "total": len(result_set),
+        "offset": start,
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "columns": columns,
+        "companies": companies,
+        "company_counts": company_counts,
+        "results": [dict(r) for r in rows],
+    }
+
+  etag = snapshot_etag(snap, 'search', keyword, company, type_filter, cursor,
+                       page_size, sort)
+  return conditional_json(etag, build)
+
+
 # ====== 前端樣板（補回「公司下拉篩選」區塊） ======
 TEMPLATE = '''
 <!DOCTYPE html>
@@ -231,6 +2272,7 @@ TEMPLATE = '''
         cursor: pointer; transition: all 0.15s;
     }
     .chip:hover, .chip.selected { background: #2462ea; border-color: #ffd857; box-shadow: 0 2px 10px #2462ea77; }
+    .chip-count { margin-left: 4px; font-size: 0.8rem; font-weight: 600; opacity: 0.75; }
     .filter-row { margin: 6px 0 0 0; display: flex; align-items: center; gap: 10px; color: #ffd857; }
     .filter-row label { font-weight: 800; }
     select[name=company_filter] {
@@ -249,6 +2291,10 @@ TEMPLATE = '''
     .searching { color: #ffd857; font-weight: 700; font-size: 1.05rem; padding: 14px 0; text-align:center;}
     th, td { min-width: 130px; }
     th:nth-child(4), td:nth-child(4) { min-width: 170px !important; white-space: normal !important; }
+    th.sortable { cursor: pointer; user-select: none; }
+    .pager { margin: 14px 0 0 0; display: flex; align-items: center; gap: 16px; color: #ffd857; font-weight: 700; }
+    th[data-dir=asc]::after { content: ' ▲'; }
+    th[data-dir=desc]::after { content: ' ▼'; }
     @media (max-width: 700px) {
         .main-wrap { padding: 10px 1vw; }
         table, th, td { font-size: 0.95rem; }
@@ -272,7 +2318,93 @@ TEMPLATE = '''
         showLoading();
         setTimeout(function(){document.getElementById('search-form').submit();}, 10);
     }
-    window.onload = function(){ hideLoading(); }
+    // 結果頁內嵌整份結果（JSON）：公司篩選與排序都在瀏覽器完成，不必再查一次
+    var resultData = null;
+    var sortState = { col: -1, asc: true };
+    function loadResultData() {
+        var el = document.getElementById('result-data');
+        if (el) resultData = JSON.parse(el.textContent);
+    }
+    function filterCompany(val) {
+        document.getElementById('company_filter').value = val;
+        if (!resultData) {
+            showLoading();
+            document.getElementById('company-form').submit();
+            return;
+        }
+        renderRows();
+        var url = new URL(window.location.href);
+        if (val) { url.searchParams.set('company_filter', val); } else { url.searchParams.delete('company_filter'); }
+        history.replaceState(null, '', url);
+    }
+    function sortBy(col) {
+        if (!resultData) return;
+        if (sortState.col === col) { sortState.asc = !sortState.asc; } else { sortState.col = col; sortState.asc = true; }
+        var ths = document.querySelectorAll('#result-table th');
+        for (var i = 0; i < ths.length; i++) {
+            if (i === col) { ths[i].setAttribute('data-dir', sortState.asc ? 'asc' : 'desc'); } else { ths[i].removeAttribute('data-dir'); }
+        }
+        renderRows();
+    }
+    function renderRows() {
+        var company = document.getElementById('company_filter').value;
+        var ci = resultData.company;
+        var rows = resultData.rows.filter(function(r){ return !company || r[ci] === company; });
+        if (sortState.col >= 0) {
+            var c = sortState.col, dir = sortState.asc ? 1 : -1;
+            rows.sort(function(a, b){ return a[c].localeCompare(b[c], 'zh-Hant', { numeric: true }) * dir; });
+        }
+        var frag = document.createDocumentFragment();
+        rows.forEach(function(r){
+            var tr = document.createElement('tr');
+            r.forEach(function(v){
+                var td = document.createElement('td');
+                if (v && v.indexOf('http') === 0) {
+                    var a = document.createElement('a');
+                    a.href = v; a.target = '_blank'; a.textContent = v;
+                    td.appendChild(a);
+                } else {
+                    td.textContent = v;
+                }
+                tr.appendChild(td);
+            });
+            frag.appendChild(tr);
+        });
+        document.getElementById('result-body').replaceChildren(frag);
+        document.getElementById('result-count').textContent = rows.length;
+        var label = document.getElementById('company-label');
+        label.textContent = '';
+        if (company) {
+            var b = document.createElement('b');
+            b.textContent = company;
+            label.append('｜公司：', b);
+        }
+    }
+    // 輸入時查 /api/suggest 給前綴建議：停手 150ms 才送，新的請求會取消還沒回來的舊請求
+    var suggestTimer = null, suggestRequest = null;
+    function suggest(val) {
+        clearTimeout(suggestTimer);
+        if (suggestRequest) { suggestRequest.abort(); suggestRequest = null; }
+        val = val.trim();
+        if (!val) { document.getElementById('suggestions').replaceChildren(); return; }
+        suggestTimer = setTimeout(function(){
+            suggestRequest = new AbortController();
+            fetch('/api/suggest?q=' + encodeURIComponent(val), { signal: suggestRequest.signal })
+                .then(function(r){ return r.json(); })
+                .then(function(data){
+                    var frag = document.createDocumentFragment();
+                    (data.suggestions || []).forEach(function(s){
+                        var opt = document.createElement('option');
+                        opt.value = s.value;
+                        opt.label = (s.kind === 'company' ? '公司' : '標題') + '・' + s.count + ' 筆';
+                        frag.appendChild(opt);
+                    });
+                    document.getElementById('suggestions').replaceChildren(frag);
+                })
+                .catch(function(){});
+        }, 150);
+    }
+    window.onload = function(){ loadResultData(); hideLoading(); }
 </script>
 </head>
 <body>
@@ -280,27 +2412,25 @@ TEMPLATE = '''
     <div class="title-row">
         <h1>亞瑞特案例庫搜尋</h1>
         <form id="search-form" method="get" action="/" onsubmit="showLoading()">
-            <input type="text" id="keyword" name="keyword" placeholder="輸入關鍵字（同時比對 Company / Title）" value="{{ keyword or '' }}">
+            <input type="text" id="keyword" name="keyword" placeholder="輸入關鍵字（多個詞 = 都要符合；可用 OR、-排除、company: type: sheet:）" value="{{ keyword or '' }}" list="suggestions" autocomplete="off" oninput="suggest(this.value)">
+            <datalist id="suggestions"></datalist>
             <input type="hidden" id="company_filter" name="company_filter" value="{{ company_filter or '' }}">
+            {% if sort == 'relevance' %}<input type="hidden" name="sort" value="relevance">{% endif %}
             <button type="submit">搜尋</button>
         </form>
     </div>
 
     <div class="category-bar">
-        {% for cat in categories %}
-        <button type="button" class="chip {% if keyword == cat %}selected{% endif %}" onclick="quickSearch('{{cat}}')">{{cat}}</button>
-        {% endfor %}
+        {{ chip_bar }}
     </div>
 
     {% if keyword and companies %}
-    <form method="get" id="company-form" class="filter-row" onsubmit="showLoading()">
+    <form method="get" id="company-form" class="filter-row" onsubmit="filterCompany(document.getElementById('company_select').value); return false;">
         <input type="hidden" name="keyword" value="{{ keyword }}">
+        {% if sort == 'relevance' %}<input type="hidden" name="sort" value="relevance">{% endif %}
         <label for="company_select">篩選公司/品牌：</label>
-        <select id="company_select" name="company_filter" onchange="document.getElementById('company-form').submit();">
-            <option value="" {% if not company_filter %}selected{% endif %}>全部</option>
-            {% for c in companies %}
-                <option value="{{ c }}" {% if company_filter == c %}selected{% endif %}>{{ c }}</option>
-            {% endfor %}
+        <select id="company_select" name="company_filter" onchange="filterCompany(this.value);">
+            {{ company_options }}
         </select>
     </form>
     {% endif %}
@@ -315,18 +2445,19 @@ TEMPLATE = '''
 
     <div id="result-box">
     {% if keyword and not error_msg %}
-        {% if results %}
-            <div class="count-row">🔍 條件：<b>{{ keyword }}</b>{% if company_filter %}｜公司：<b>{{ company_filter }}</b>{% endif %} ｜ 符合 <b>{{ results|length }}</b> 筆</div>
+        {% if matched %}
+            <div class="count-row">🔍 條件：<b>{{ keyword }}</b><span id="company-label">{% if company_filter %}｜公司：<b>{{ company_filter }}</b>{% endif %}</span> ｜ 符合 <b id="result-count">{{ total }}</b> 筆
+                ｜ {% if sort == 'relevance' %}依相關度（前 {{ results|length }} 筆）<a href="{{ url_for('index', keyword=keyword, company_filter=company_filter or None, sort='sheet') }}">改依工作表順序</a>{% else %}<a href="{{ url_for('index', keyword=keyword, company_filter=company_filter or None, sort='relevance') }}">依相關度排序</a>{% endif %}</div>
             <div style="overflow-x: auto;">
-            <table>
+            <table id="result-table">
                 <thead>
                     <tr>
                         {% for col in columns %}
-                        <th>{{ col }}</th>
+                        <th class="sortable" onclick="sortBy({{ loop.index0 }})">{{ col }}</th>
                         {% endfor %}
                     </tr>
                 </thead>
-                <tbody>
+                <tbody id="result-body">
                     {% for row in results %}
                     <tr>
                         {% for col in columns %}
@@ -344,6 +2475,16 @@ TEMPLATE = '''
                 </tbody>
             </table>
             </div>
+            {% if prev_cursor or next_cursor %}
+            <div class="pager">
+                {% if prev_cursor %}<a href="{{ url_for('index', keyword=keyword, company_filter=company_filter or None, cursor=prev_cursor) }}">← 上一頁</a>{% endif %}
+                <span>第 {{ offset + 1 }}–{{ offset + results|length }} 筆，共 {{ total }} 筆</span>
+                {% if next_cursor %}<a href="{{ url_for('index', keyword=keyword, company_filter=company_filter or None, cursor=next_cursor) }}">下一頁 →</a>{% endif %}
+            </div>
+            {% endif %}
+            {% if payload.rows %}
+            <script id="result-data" type="application/json">{{ payload|tojson }}</script>
+            {% endif %}
         {% elif keyword %}
             <div class="no-result">❌ 找不到任何符合「{{keyword}}{% if company_filter %}／{{company_filter}}{% endif %}」的資料。</div>
         {% endif %}
@@ -354,75 +2495,150 @@ TEMPLATE = '''
 </html>
 '''
 
+# 類別按鈕列與公司下拉選項：只在資料（快照版本）改變時才需要重畫，渲染後快取
+CHIP_BAR_TEMPLATE = '''{% for cat in categories %}
+        <button type="button" class="chip {% if keyword == cat %}selected{% endif %}" onclick="quickSearch('{{cat}}')">{{cat}} <span class="chip-count">{{ type_counts.get(cat, 0) }}</span></button>
+        {% endfor %}'''
+
+COMPANY_OPTIONS_TEMPLATE = '''<option value="" {% if not company_filter %}selected{% endif %}>全部</option>
+            {% for c in companies %}
+                <option value="{{ c }}" {% if company_filter == c %}selected{% endif %}>{{ c }}{% if c in company_counts %}（{{ company_counts[c] }}）{% endif %}</option>
+            {% endfor %}'''
+
+
+
+# 模板在啟動時編譯一次，之後每個請求直接用
+PAGE = app.jinja_env.from_string(TEMPLATE)
+CHIP_BAR = app.jinja_env.from_string(CHIP_BAR_TEMPLATE)
+COMPANY_OPTIONS = app.jinja_env.from_string(COMPANY_OPTIONS_TEMPLATE)
+
+# 片段快取：與查詢快取同樣以快照版本為準，換版時清空
+FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", "512"))
+fragment_cache = QueryCache(FRAGMENT_CACHE_SIZE)
+
+
+def render_fragment(template, version, key, **context):
+  """渲染 HTML 片段；有快照版本時依 (key, 版本) 快取。"""
+  if version is None:
+    return Markup(template.render(**context))
+  return fragment_cache.get_or_compute(
+      key, version, lambda: Markup(template.render(**context)))
+
+
+def render_page(**context):
+  """用預先編譯好的頁面模板渲染（等同 render_template_string，但不重新編譯）。"""
+  app.update_template_context(context)
+  return PAGE.render(context)
+
+
+def stream_page(**context):
+  """
+    串流輸出結果頁：頁首、類別按鈕、表頭先送出，結果列在模板走到時才逐列組出，
+    每累積 STREAM_BUFFER 段就送一次，記憶體用量不隨結果筆數成長。
+    """
+  app.update_template_context(context)
+  stream = PAGE.stream(context)
+  stream.enable_buffering(STREAM_BUFFER)
+  return Response(stream_with_context(stream), mimetype='text/html')
+
 
 # ====== 路由 ======
 @app.route('/', methods=['GET'])
 def index():
   error_msg = ""
+  version = None
   try:
-    categories = get_all_types()
+    with timed('snapshot'):
+      snap = snapshots.get()
+    categories, version = list(snap.types), snap.version
+    type_counts = snap.facets()["types"]
   except Exception as e:
     error_msg = f"授權或讀取 Google 試算表失敗：{e}. 請確認已在 Vercel 設定 CREDENTIALS_JSON，且把試算表分享給服務帳戶信箱。"
     categories = []
+    type_counts = {}
 
   keyword = request.args.get('keyword', '').strip()
   company_filter = request.args.get('company_filter', '').strip()
+  cursor = request.args.get('cursor', '')
+  stream = request.args.get('stream', STREAM_RESULTS) == '1'
+  sort = request.args.get('sort', DEFAULT_SORT)
 
   results, columns, companies = [], [], []
+  company_counts = {}
+  payload = {"rows": []}
+  matched = total = offset = 0
+  next_cursor = prev_cursor = None
   if keyword and not error_msg:
     try:
-      results, all_fields = get_results(keyword, categories)
-
-      # 產生唯一 Company 清單（依首次出現順序）
-      seen = set()
-      for r in results:
-        c = r.get('Company', '').strip()
-        if c and c not in seen:
-          seen.add(c)
-          companies.append(c)
-
-      # 依公司下拉篩選
-      if company_filter:
-        results = [
-            r for r in results
-            if r.get('Company', '').strip() == company_filter
-        ]
+      with timed('search'):
+        result_set = search(keyword, categories, snap)
+      companies = result_set.companies
+      company_counts = result_set.company_counts
+      columns = pick_columns(result_set.all_fields)
+      matched = len(result_set)
+
+      with timed('rows'):
+        # 結果只有一頁時整份內嵌給前端，公司篩選 / 排序直接在瀏覽器做
+        if matched <= PAGE_SIZE:
+          if sort == 'relevance':
+            rows = ranked_rows(result_set, keyword, PAGE_SIZE)
+          else:
+            rows = result_set.rows()
+          payload = result_payload(rows, columns)
+
+        # 依公司下拉篩選
+        if company_filter:
+          result_set = result_set.where('Company', company_filter)
 
-      # 欄位順序：Type → Company → Title → Video url → 分類 → 來源工作表 → 其他
-      def pick_columns(cols):
-        order, added = [], set()
-
-        def add(name):
-          if name in cols and name not in added:
-            order.append(name)
-            added.add(name)
-
-        add('Type')
-        add('Company')
-        add('Title')
-        add('Video url')
-        add('分類')
-        add('來源工作表')
-        for c in cols:
-          if c not in added and not is_type_col(c):
-            order.append(c)
-            added.add(c)
-        return order
-
-      columns = pick_columns(all_fields)
+        total = len(result_set)
+        if sort == 'relevance':
+          # 只顯示相關度最高的一頁，其餘的列不組出來（沒篩選且只有一頁時沿用上面排好的）
+          if matched <= PAGE_SIZE and not company_filter:
+            results = rows
+          else:
+            results = ranked_rows(result_set, keyword, PAGE_SIZE,
+                                  (company_filter,))
+        elif stream:
+          results = result_set.iter_rows()
+        else:
+          results, offset, next_cursor, prev_cursor = paginate(
+              result_set, cursor, PAGE_SIZE)
 
     except Exception as e:
       traceback.print_exc()
       error_msg = f"查詢過程發生錯誤：{e}"
 
-  return render_template_string(TEMPLATE,
-                                results=results,
-                                keyword=keyword,
-                                columns=columns,
-                                categories=categories,
-                                companies=companies,
-                                company_filter=company_filter,
-                                error_msg=error_msg)
+  with timed('fragments'):
+    selected = keyword if keyword in categories else ''
+    chip_bar = render_fragment(CHIP_BAR, version, ('chips', selected),
+                               categories=categories,
+                               keyword=selected,
+                               type_counts=type_counts)
+    company_options = render_fragment(COMPANY_OPTIONS, version,
+                                      ('companies', keyword, company_filter),
+                                      companies=companies,
+                                      company_filter=company_filter,
+                                      company_counts=company_counts)
+  context = dict(results=results,
+                 keyword=keyword,
+                 columns=columns,
+                 categories=categories,
+                 companies=companies,
+                 company_filter=company_filter,
+                 sort=sort,
+                 payload=payload,
+                 matched=matched,
+                 total=total,
+                 offset=offset,
+                 next_cursor=next_cursor,
+                 prev_cursor=prev_cursor,
+                 chip_bar=chip_bar,
+                 company_options=company_options,
+                 error_msg=error_msg)
+  if stream:
+    return stream_page(**context)
+  with timed('render'):
+    return render_page(**context)
 
 
 if __name__ == '__main__':
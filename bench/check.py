@@ -0,0 +1,234 @@
+"""
+離線的行為檢查：用 bench/fake_sheets.py 的假試算表跑兩份 app（api/index.py 與
+Arete Select/main.py），確認容易出錯的邊界情況。全部通過就印 OK，否則 exit 1。
+
+    python bench/check.py
+    python bench/check.py --app api/index.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from fake_sheets import make_spreadsheet  # noqa: E402
+from run import load_app, use_spreadsheet  # noqa: E402
+
+DEFAULT_APPS = [
+    BENCH_DIR.parent / 'api' / 'index.py',
+    BENCH_DIR.parent / 'Arete Select' / 'main.py',
+]
+
+
+def check_paginate(app, snap):
+    """cursor 超過結尾（手改或資料更新後過期）不能出錯，上一頁要指向最後一頁。"""
+    result_set = app.search('a', snap.types, snap)
+    total = len(result_set)
+    ids = result_set.ids
+    page_size = 10
+    for gid in (ids[-1], ids[-1] + 1, 10**6):
+        rows, start, next_cursor, prev_cursor = app.paginate(
+            result_set, app.encode_cursor('a', gid, snap.digest), page_size)
+        assert rows == [] and start == total and next_cursor is None, gid
+        rows, start, _, _ = app.paginate(result_set, prev_cursor, page_size)
+        assert start == total - page_size and len(rows) == page_size, gid
+
+    empty = app.ResultSet(snap, [])
+    assert app.paginate(
+        empty, app.encode_cursor('a', 5, snap.digest), page_size) == (
+        [], 0, None, None)
+
+    client = app.app.test_client()
+    cursor = app.encode_cursor('a', 10**6, snap.digest)
+    response = client.get('/api/search',
+                          query_string={'keyword': 'a', 'cursor': cursor})
+    assert response.status_code == 200, response.status_code
+    body = response.get_json()
+    assert body['results'] == [] and body['prev_cursor'], body
+    response = client.get('/', query_string={'keyword': 'a', 'cursor': cursor})
+    assert response.status_code == 200, response.status_code
+
+
+def check_paginate_after_update(app, snap):
+    """資料更新後（列編號位移），舊的 cursor 要從第一頁開始，不能回傳錯位的頁面。"""
+    spreadsheet = app.gclient().spreadsheet
+    sheet = make_spreadsheet(400, n_tabs=2, seed=1)
+    use_spreadsheet(app, sheet)
+    try:
+        before = app.snapshots.refresh()
+        result_set = app.search('a', before.types, before)
+        page, start, next_cursor, _ = app.paginate(result_set, None, 10)
+        assert start == 0 and next_cursor
+        _, start, _, _ = app.paginate(result_set, next_cursor, 10)
+        assert start == 10, start
+
+        # 第一個分頁最上面插入幾列：後面每一列的全域列編號都往後移
+        ws = sheet.worksheets()[0]
+        header, *rows = ws.get_all_values()
+        sheet.touch(ws.title, [header, *rows[:5], *rows])
+        after = app.snapshots.refresh()
+        assert after.digest != before.digest
+        result_set = app.search('a', after.types, after)
+        first = app.paginate(result_set, None, 10)
+        assert app.paginate(result_set, next_cursor, 10) == first
+    finally:
+        use_spreadsheet(app, spreadsheet)
+        app.snapshots._snapshot = snap
+
+
+def check_fetch_single_batch(app, snap):
+    """預設所有分頁一次 batchGet 讀完：分頁再多，每次重讀也只花一個讀取配額。"""
+    sheet = make_spreadsheet(240, n_tabs=24, seed=2)
+    values = app.fetch_all_values(sheet)
+    assert [title for title, _ in values] == [
+        ws.title for ws in sheet.worksheets()]
+    assert sheet.calls['values_batch_get'] == 1, sheet.calls
+
+
+def check_query_cache_versions(app, snap):
+    """換版瞬間還拿著舊快照的請求不能清掉新版本的快取，也不能把舊結果放進去。"""
+    cache = app.QueryCache(8)
+    cache.get_or_compute('k', 2, lambda: 'new')
+    assert cache.get_or_compute('k', 1, lambda: 'old') == 'old'
+    assert cache.get_or_compute('k', 2, lambda: 'again') == 'new'
+    assert cache.get_or_compute('k', 3, lambda: 'newer') == 'newer'
+    assert cache.get_or_compute('k', 2, lambda: 'stale') == 'stale'
+    assert cache.get_or_compute('k', 3, lambda: 'again') == 'newer'
+
+
+def check_cold_start_bridge(app, snap):
+    """從快照檔冷啟動後要在背景換成記憶體索引，變更標記沒變也一樣，版本與雜湊不變。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'snapshot.sqlite3')
+        app.save_snapshot(snap, path)
+        stored = app.open_stored_snapshot(path)
+        assert isinstance(stored, app.StoredSnapshot), stored
+        stored.bridge = True
+        try:
+            app.snapshots._snapshot = stored
+            assert app.snapshots.get() is stored
+            deadline = time.time() + 10
+            while app.snapshots._snapshot is stored and time.time() < deadline:
+                time.sleep(0.01)
+            rebuilt = app.snapshots._snapshot
+            assert type(rebuilt) is app.Snapshot, type(rebuilt)
+            assert not rebuilt.bridge
+            assert (rebuilt.version, rebuilt.digest) == (
+                stored.version, stored.digest), rebuilt.version
+            # 換上記憶體索引後，標記沒變就照舊沿用
+            assert app.fetch_snapshot(rebuilt) is rebuilt
+        finally:
+            app.snapshots._snapshot = snap
+
+
+def check_save_reused_stored_tables(app, snap):
+    """冷啟動後讀取失敗的分頁沿用快照檔的 StoredTable，存檔時要照樣寫進新檔。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        first = os.path.join(tmp, 'first.sqlite3')
+        app.save_snapshot(snap, first)
+        stored = app.open_stored_snapshot(first)
+        # 第一個分頁換成記憶體索引，其餘沿用快照檔
+        mixed = app.Snapshot(snap.version + 1,
+                             [snap.tables[0], *stored.tables[1:]],
+                             snap.modified)
+        second = os.path.join(tmp, 'second.sqlite3')
+        app.save_snapshot(mixed, second)
+        assert os.path.exists(second), 'mixed snapshot was not saved'
+        reopened = app.open_stored_snapshot(second)
+        assert reopened.digest == snap.digest
+        for gid in range(0, snap.size, max(1, snap.size // 50)):
+            assert reopened.row(gid) == snap.row(gid), gid
+        assert reopened.search('apple') == snap.search('apple')
+
+
+def check_no_retry_on_missing_files(app, snap):
+    """資料夾不存在是設定錯誤，要立刻失敗，不能照暫時錯誤退避重試。"""
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = app.FolderBackend(os.path.join(tmp, 'missing'))
+        start = time.time()
+        try:
+            app.with_backoff(backend.modified)
+        except FileNotFoundError:
+            pass
+        else:
+            raise AssertionError('missing folder did not raise')
+        assert time.time() - start < 0.5, time.time() - start
+    assert not app.is_retryable(PermissionError('denied'))
+    assert app.is_retryable(app.requests.exceptions.ConnectionError('reset'))
+
+
+def check_query_parser(app, snap):
+    """查詢語法的邊界情況：每個查詢的結果要等於用單一關鍵字組出來的集合。"""
+    def find(needle):
+        return set(snap.search(needle))
+
+    everything = set(range(snap.size))
+    cases = [
+        # 整串都不成詞：照舊整串當子字串比對
+        ('OR', find('or')),
+        ('|', find('|')),
+        ('AND', find('and')),
+        ('"', find('"')),
+        ('OR |', find('or |')),
+        # OR 裡的排除詞：符合 a 或不含 b
+        ('a OR -b', find('a') | (everything - find('b'))),
+        ('-b OR a', find('a') | (everything - find('b'))),
+        ('a -b', find('a') - find('b')),
+        # 欄位名稱後面沒有值：當一般文字
+        ('company:', find('company:')),
+        ('company: apple', find('company:') & find('apple')),
+        ('company:"" apple', find('apple')),
+        # 看起來像欄位的網址與「xxx:」
+        ('https://youtu', find('https://youtu')),
+        ('-https://youtu', everything - find('https://youtu')),
+        ('x:y', find('x:y')),
+        ('company:apple', set(snap.value_ids('Company', 'apple'))),
+    ]
+    assert find('https://youtu'), 'fake sheet has no URLs'
+    for text, expected in cases:
+        ids = app.Query(text).match(snap)
+        assert ids == expected, (text, len(ids), len(expected))
+        assert app.find_ids(text, (), snap) == sorted(expected), text
+
+
+CHECKS = [
+    check_paginate,
+    check_paginate_after_update,
+    check_fetch_single_batch,
+    check_query_cache_versions,
+    check_cold_start_bridge,
+    check_save_reused_stored_tables,
+    check_no_retry_on_missing_files,
+    check_query_parser,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--app', action='append',
+                        help='要檢查的 app 檔案（可重複；預設兩份都查）')
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    failed = 0
+    for i, path in enumerate(args.app or DEFAULT_APPS):
+        app = load_app(path, f'check_app_{i}')
+        use_spreadsheet(app, make_spreadsheet(args.rows))
+        snap = app.snapshots.refresh()
+        for check in CHECKS:
+            try:
+                check(app, snap)
+            except AssertionError as e:
+                failed += 1
+                print(f"FAIL {Path(path).name} {check.__name__}: {e!r}")
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
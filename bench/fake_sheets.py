@@ -0,0 +1,152 @@
+"""
+離線用的假 gspread 試算表與資料產生器（給 bench/ 底下的腳本用，不需網路與憑證）。
+
+FakeSpreadsheet / FakeWorksheet 只實作 app 用到的介面：
+worksheets()、values_batch_get()、get_lastUpdateTime()，以及 Worksheet 的
+get_all_values() / get_all_records()。資料由固定 seed 產生，每次結果相同。
+"""
+import random
+
+from gspread.utils import numericise_all
+
+TYPES = ['美妝', '3C', '食品', 'Fashion', '汽車', '旅遊', 'Finance', '遊戲', '家電', '保健']
+COMPANIES = [
+    'Apple', '蘋果', 'Sony 索尼', "L'OREAL 萊雅", '統一', 'Toyota', '全聯', 'Nike',
+    'Samsung', '華碩 ASUS', '星巴克', 'Uber Eats', '中華電信', 'IKEA'
+]
+WORDS = [
+    '廣告', '影片', 'launch', 'Campaign', '新品', '發表', 'Summer', '品牌', 'TVC',
+    '開箱', 'Vlog', '聯名', 'Teaser', '形象', 'Official', '預告', 'MV', '30秒',
+    'Behind the scenes', '微電影', 'Cut', '限時'
+]
+CATEGORIES = ['電視廣告', '網路影片', '社群短片', '直播', '']
+# 很少出現的詞，用來測高選擇性的關鍵字
+RARE_WORDS = ['Limited', '限定款']
+# 表頭拼法跟真實試算表一樣不統一
+TYPE_HEADERS = ['Type', 'tpye', 'Tpye ', 'TYPE', 'typ', 'tpey']
+COMPANY_HEADERS = ['Company', '品牌', 'brand', '公司', 'Brand ']
+
+
+def generate_sheet(rng, n_rows):
+    """產生一個分頁的 values（第一列是表頭），尾端空白格像 API 一樣截掉。"""
+    header = [
+        rng.choice(TYPE_HEADERS),
+        rng.choice(COMPANY_HEADERS), 'Title', 'Video url', '分類', 'Note'
+    ]
+    if rng.random() < 0.3:
+        header.append('Agency')
+    values = [header]
+    for i in range(n_rows):
+        r = rng.random()
+        if r < 0.02:
+            values.append([])  # 空白列
+            continue
+        title = ' '.join(rng.sample(WORDS, rng.randint(2, 4)))
+        if rng.random() < 0.001:
+            title += ' ' + rng.choice(RARE_WORDS)
+        if rng.random() < 0.02:
+            title += '​\n'  # 零寬字元與斷行，clean_cell 要清掉
+        row = [
+            rng.choice(TYPES) if r > 0.05 else '',
+            rng.choice(COMPANIES) if r > 0.04 else '',
+            title if r > 0.03 else '',
+            f'https://youtu.be/{rng.getrandbits(40):010x}' if r > 0.06 else '',
+            rng.choice(CATEGORIES),
+            str(rng.randint(2015, 2025)) if rng.random() < 0.5 else '',
+        ]
+        if len(header) == 7:
+            row.append(rng.choice(['', '奧美', 'Dentsu', '李奧貝納']))
+        while row and row[-1] == '':
+            row.pop()
+        values.append(row)
+    return values
+
+
+class FakeWorksheet:
+
+    def __init__(self, title, values, sheet_id):
+        self.title = title
+        self.id = sheet_id
+        self.values = values
+
+    def get_all_values(self):
+        return [list(r) for r in self.values]
+
+    def get_all_records(self):
+        if not self.values:
+            return []
+        width = max(len(r) for r in self.values)
+        rows = [list(r) + [''] * (width - len(r)) for r in self.values]
+        return [dict(zip(rows[0], numericise_all(r))) for r in rows[1:]]
+
+
+class FakeSpreadsheet:
+    """記憶體裡的試算表；calls 記錄各 API 被呼叫幾次。"""
+
+    def __init__(self, sheets):
+        self.id = 'fake-spreadsheet'
+        self._worksheets = [
+            FakeWorksheet(title, values, i)
+            for i, (title, values) in enumerate(sheets)
+        ]
+        self.version = 0
+        self.calls = {}
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    @property
+    def lastUpdateTime(self):
+        return f'2026-01-01T00:00:{self.version:02d}Z'
+
+    def get_lastUpdateTime(self):
+        self._count('get_lastUpdateTime')
+        return self.lastUpdateTime
+
+    def worksheets(self):
+        self._count('worksheets')
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        return next(ws for ws in self._worksheets if ws.title == title)
+
+    def values_batch_get(self, ranges, params=None):
+        self._count('values_batch_get')
+        by_range = {
+            "'" + ws.title.replace("'", "''") + "'": ws
+            for ws in self._worksheets
+        }
+        value_ranges = []
+        for name in ranges:
+            vr = {'range': name}
+            values = by_range[name].get_all_values()
+            if values:
+                vr['values'] = values
+            value_ranges.append(vr)
+        return {'valueRanges': value_ranges}
+
+    def touch(self, title, values):
+        """改掉一個分頁的內容（modifiedTime 跟著變），模擬有人編輯試算表。"""
+        self.worksheet(title).values = values
+        self.version += 1
+
+
+class FakeClient:
+
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+def make_spreadsheet(n_rows, n_tabs=8, seed=0):
+    """n_rows 筆資料平均分到 n_tabs 個分頁。"""
+    rng = random.Random(seed)
+    per_tab, extra = divmod(n_rows, n_tabs)
+    sheets = []
+    for i in range(n_tabs):
+        title = rng.choice(['2024 廣告', 'TVC', '網路影片', 'Campaign', '社群']) + f' {i}'
+        sheets.append(
+            (title, generate_sheet(rng, per_tab + (1 if i < extra else 0))))
+    return FakeSpreadsheet(sheets)
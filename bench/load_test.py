@@ -0,0 +1,248 @@
+"""
+整個 Flask app 的併發壓力測試：用假資料（bench/fake_sheets.py 產生的 CSV，
+以 DATA_SOURCE=folder 讀取）啟動 gunicorn，依比例混合送出關鍵字搜尋、
+類別按鈕與公司篩選請求，回報各種 worker / thread 設定下的吞吐量、延遲與錯誤率。
+
+    python bench/load_test.py                                # 1x1、2x4、4x8
+    python bench/load_test.py --configs 1x1,4x1,1x8 --concurrency 32 --duration 30
+    python bench/load_test.py --server flask                 # 沒有 gunicorn 時用內建 server
+
+--configs 的每一項是「workers x threads」；預設跟 Dockerfile 一樣跑 Arete Select/main.py。
+"""
+import argparse
+import csv
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from fake_sheets import COMPANIES, TYPES, WORDS, make_spreadsheet  # noqa: E402
+
+DEFAULT_APP_DIR = BENCH_DIR.parent / 'Arete Select'
+
+
+def write_dataset(directory, n_rows, n_tabs, seed):
+    """把假試算表的每個分頁寫成一個 CSV 檔。"""
+    spreadsheet = make_spreadsheet(n_rows, n_tabs, seed)
+    for ws in spreadsheet.worksheets():
+        with open(Path(directory) / f'{ws.title}.csv', 'w', newline='',
+                  encoding='utf-8') as f:
+            csv.writer(f).writerows(ws.get_all_values())
+
+
+def request_mix(weights, rng):
+    """依權重產生請求路徑：keyword = 自由關鍵字、chip = 類別按鈕、company = 類別 + 公司篩選。"""
+    makers = {
+        'keyword': lambda: {'keyword': rng.choice(WORDS + COMPANIES)},
+        'chip': lambda: {'keyword': rng.choice(TYPES)},
+        'company': lambda: {
+            'keyword': rng.choice(TYPES),
+            'company_filter': rng.choice(COMPANIES)
+        },
+    }
+    kinds = list(weights)
+    kind_weights = [weights[k] for k in kinds]
+    while True:
+        kind = rng.choices(kinds, kind_weights)[0]
+        yield kind, '/?' + urllib.parse.urlencode(makers[kind]())
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workers, threads, port, data_dir, log):
+    env = dict(os.environ,
+               DATA_SOURCE='folder',
+               DATA_PATH=str(data_dir),
+               SNAPSHOT_DB='',
+               PYTHONUNBUFFERED='1')
+    if args.server == 'gunicorn':
+        cmd = [
+            sys.executable, '-m', 'gunicorn', '-w',
+            str(workers), '--threads',
+            str(threads), '-b', f'127.0.0.1:{port}', '--log-level',
+            'warning', args.module
+        ]
+    else:
+        # 內建 server 只有一個 process，每個請求一條執行緒
+        cmd = [
+            sys.executable, '-m', 'flask', '--app',
+            args.module.split(':')[0], 'run', '--port',
+            str(port), '--with-threads'
+        ]
+    return subprocess.Popen(cmd,
+                            cwd=args.app_dir,
+                            env=env,
+                            stdout=log,
+                            stderr=subprocess.STDOUT)
+
+
+def wait_ready(port, server, log, timeout=120):
+    """等 server 起來並載入好快照（第一次請求會觸發載入）。"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(log.read().decode('utf-8', 'replace'))
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            conn.request('GET', '/api/categories')
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server 沒有在時間內啟動')
+
+
+def client_loop(port, paths, stop_at, records, lock):
+    """一條連線（keep-alive）持續送請求直到時間到；連線斷了就重連。"""
+    conn = None
+    local = []
+    while time.time() < stop_at:
+        kind, path = next(paths)
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port,
+                                                  timeout=30)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            ok = False
+            if conn is not None:
+                conn.close()
+            conn = None
+        local.append((kind, (time.perf_counter() - started) * 1000, ok))
+    if conn is not None:
+        conn.close()
+    with lock:
+        records.extend(local)
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(label, records, elapsed):
+    latencies = sorted(ms for _, ms, _ in records)
+    errors = sum(1 for _, _, ok in records if not ok)
+    return {
+        'config': label,
+        'requests': len(records),
+        'rps': round(len(records) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 1),
+        'p90_ms': round(percentile(latencies, 0.90), 1),
+        'p99_ms': round(percentile(latencies, 0.99), 1),
+        'max_ms': round(latencies[-1], 1) if latencies else 0.0,
+        'error_rate': round(errors / len(records), 4) if records else 0.0,
+        'by_kind': {
+            kind: len([r for r in records if r[0] == kind])
+            for kind in sorted({r[0] for r in records})
+        },
+    }
+
+
+def run_config(args, workers, threads, data_dir):
+    port = free_port()
+    # server 的輸出寫到暫存檔（用 pipe 沒人讀會塞住），啟動失敗時再印出來
+    log = tempfile.TemporaryFile()
+    server = start_server(args, workers, threads, port, data_dir, log)
+    try:
+        wait_ready(port, server, log)
+        records, lock = [], threading.Lock()
+        # 先暖身（各 worker 載入快照、填快取），不列入統計
+        for duration in (args.warmup, args.duration):
+            records.clear()
+            stop_at = time.time() + duration
+            clients = [
+                threading.Thread(target=client_loop,
+                                 args=(port,
+                                       request_mix(args.weights,
+                                                   random.Random(args.seed + i)),
+                                       stop_at, records, lock))
+                for i in range(args.concurrency)
+            ]
+            started = time.time()
+            for t in clients:
+                t.start()
+            for t in clients:
+                t.join()
+        return summarize(f'{workers}x{threads}', records,
+                         time.time() - started)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        log.close()
+
+
+def parse_weights(text):
+    weights = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        weights[kind.strip()] = float(weight or 1)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--configs', default='1x1,2x4,4x8',
+                        help='逗號分隔的 workers x threads')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='同時送請求的連線數')
+    parser.add_argument('--duration', type=float, default=15,
+                        help='每個設定量測幾秒')
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--tabs', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mix', default='keyword=5,chip=3,company=2',
+                        help='請求種類的比例')
+    parser.add_argument('--server', choices=['gunicorn', 'flask'],
+                        default='gunicorn')
+    parser.add_argument('--app-dir', default=str(DEFAULT_APP_DIR))
+    parser.add_argument('--module', default='main:app')
+    parser.add_argument('--save', help='把結果寫成 JSON')
+    args = parser.parse_args()
+    args.weights = parse_weights(args.mix)
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_dataset(data_dir, args.rows, args.tabs, args.seed)
+        print(f"{'config':<10}{'requests':>10}{'rps':>10}{'p50 ms':>10}"
+              f"{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>9}")
+        for config in args.configs.split(','):
+            workers, _, threads = config.partition('x')
+            r = run_config(args, int(workers), int(threads or 1), data_dir)
+            results.append(r)
+            print(f"{r['config']:<10}{r['requests']:>10}{r['rps']:>10.1f}"
+                  f"{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}"
+                  f"{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}"
+                  f"{r['error_rate']:>9.2%}")
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+搜尋核心的離線效能測試：用 bench/fake_sheets.py 的假試算表取代 Google，
+量測載入快照、get_all_types、get_results（不同選擇性的關鍵字）與 index() 渲染。
+
+    python bench/run.py                         # 1k / 10k / 100k 列
+    python bench/run.py --rows 1000,1000000     # 指定列數（1M 需要數 GB 記憶體）
+    python bench/run.py --save bench/baseline.json
+    python bench/run.py --baseline bench/baseline.json   # 比基準慢太多就 exit 1
+
+每項回報中位數 / p95 延遲（ms）、峰值記憶體與留下的記憶體（KB，tracemalloc）
+以及留下的 allocation 區塊數。
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from fake_sheets import FakeClient, generate_sheet, make_spreadsheet  # noqa: E402
+
+DEFAULT_APP = BENCH_DIR.parent / 'api' / 'index.py'
+
+# 名稱 → 關鍵字；涵蓋類別按鈕、公司、常見字、片語、組合查詢、罕見字與查無結果
+KEYWORDS = {
+    'category': '美妝',
+    'company': 'Apple',
+    'common': 'a',
+    'phrase': '"開箱 vlog"',
+    'query': 'company:apple 開箱 OR vlog -teaser',
+    'rare': 'limited',
+    'miss': 'zzzz',
+}
+
+
+def load_app(path, name='bench_app'):
+    """載入 app 模組：不寫快照檔、不開背景更新執行緒。"""
+    os.environ['SNAPSHOT_DB'] = ''
+    os.environ['SNAPSHOT_TTL'] = '0'
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def use_spreadsheet(app, spreadsheet):
+    """讓 app 的 gspread client 改讀假試算表，並清掉快照與快取。"""
+    app.gclient = lambda: FakeClient(spreadsheet)
+    app.client_pool.reset()
+    app.snapshots._snapshot = None
+    app.query_cache = app.QueryCache(app.QUERY_CACHE_SIZE)
+
+
+def timings(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[max(0, -(-len(samples) * 95 // 100) - 1)], 3),
+    }
+
+
+def memory(fn):
+    """跑一次 fn，回傳峰值 / 留下的記憶體（KB）與留下的 allocation 區塊數。"""
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained_blocks = sys.getallocatedblocks() - blocks
+    del result
+    return {
+        'peak_kb': round(peak / 1024, 1),
+        'retained_kb': round(current / 1024, 1),
+        'retained_blocks': retained_blocks,
+    }
+
+
+def bench(name, fn, repeat, results, rows):
+    record = {'name': name, 'rows': rows}
+    record.update(timings(fn, repeat))
+    record.update(memory(fn))
+    results.append(record)
+    print(f"{name:<24}{rows:>9} {record['median_ms']:>10.2f} "
+          f"{record['p95_ms']:>10.2f} {record['peak_kb']:>11.1f} "
+          f"{record['retained_kb']:>11.1f} {record['retained_blocks']:>9}")
+
+
+def run(app, n_rows, n_tabs, repeat, seed):
+    spreadsheet = make_spreadsheet(n_rows, n_tabs, seed)
+    use_spreadsheet(app, spreadsheet)
+    # 大資料集少跑幾次，總時間維持在可接受範圍
+    heavy = max(1, repeat // max(1, n_rows // 10000))
+    results = []
+
+    bench('load_cold', lambda: app.load_snapshot(None), heavy, results,
+          n_rows)
+    snap = app.snapshots.refresh()
+    bench('refresh_unchanged', lambda: app.load_snapshot(snap), repeat,
+          results, n_rows)
+
+    edited = spreadsheet.worksheets()[0]
+
+    def refresh_one_tab():
+        spreadsheet.touch(edited.title,
+                          generate_sheet(random.Random(spreadsheet.version),
+                                         n_rows // n_tabs))
+        return app.load_snapshot(snap)
+
+    bench('refresh_one_tab', refresh_one_tab, heavy, results, n_rows)
+
+    bench('get_all_types', app.get_all_types, repeat, results, n_rows)
+    categories = snap.types
+    for label, keyword in KEYWORDS.items():
+        bench(f'get_results:{label}',
+              lambda: app.get_results(keyword, categories, snap), heavy,
+              results, n_rows)
+    # 相關度排序只取前 100 名，跟組出全部結果比
+    for label in ('common', 'company'):
+        result_set = app.search(KEYWORDS[label], categories, snap)
+        query = app.Query(KEYWORDS[label])
+        bench(f'rank_top100:{label}',
+              lambda: app.rank_ids(result_set, query, 100, True), heavy,
+              results, n_rows)
+
+    client = app.app.test_client()
+    for label, keyword in KEYWORDS.items():
+        bench(f'index:{label}',
+              lambda: client.get('/', query_string={'keyword': keyword}),
+              repeat, results, n_rows)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """與基準比較中位數延遲與峰值記憶體，回傳退步的項目。"""
+    base = {(r['name'], r['rows']): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = base.get((r['name'], r['rows']))
+        if old is None:
+            continue
+        for metric in ('median_ms', 'peak_kb'):
+            # 太小的數字雜訊大，不比
+            floor = 1.0 if metric == 'median_ms' else 64.0
+            if old[metric] >= floor and r[metric] > old[metric] * threshold:
+                regressions.append(
+                    f"{r['name']}@{r['rows']} {metric}: "
+                    f"{old[metric]} -> {r[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', default='1000,10000,100000',
+                        help='逗號分隔的列數')
+    parser.add_argument('--tabs', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--app', default=str(DEFAULT_APP),
+                        help='要測的 app 檔案（預設 api/index.py）')
+    parser.add_argument('--save', help='把結果寫成 JSON（當作之後的基準）')
+    parser.add_argument('--baseline', help='與這個 JSON 基準比較')
+    parser.add_argument('--threshold', type=float, default=1.3,
+                        help='比基準慢 / 大超過幾倍算退步')
+    args = parser.parse_args()
+
+    app = load_app(args.app)
+    print(f"{'benchmark':<24}{'rows':>9} {'median ms':>10} {'p95 ms':>10} "
+          f"{'peak KB':>11} {'kept KB':>11} {'blocks':>9}")
+    results = []
+    for n_rows in [int(n) for n in args.rows.split(',')]:
+        results.extend(run(app, n_rows, args.tabs, args.repeat, args.seed))
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2,
+                                              ensure_ascii=False))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()